@@ -0,0 +1,35 @@
+# Copyright 2020 Hamal, Inc.
+
+import time
+
+from oslo_log import log as logging
+import webob.dec
+
+from hamal.db import api as db_api
+from hamal.wsgi import common as base_wsgi
+
+
+LOG = logging.getLogger(__name__)
+
+
+class DBContextWrapper(base_wsgi.Middleware):
+    """Scopes the DB calls of a request to one DB context
+
+    Logs the number of queries the request ran and the time spent in them.
+    """
+
+    @webob.dec.wsgify(RequestClass=base_wsgi.Request)
+    def __call__(self, req):
+        start = time.time()
+        with db_api.request_context() as context:
+            req.environ['hamal.db_context'] = context
+            response = req.get_response(self.application)
+
+        if context.queries:
+            LOG.info("%(method)s %(url)s ran %(queries)d queries in "
+                     "%(db_time).1fms of %(time).1fms",
+                     {'method': req.method, 'url': req.url,
+                      'queries': context.queries,
+                      'db_time': context.db_time * 1000,
+                      'time': (time.time() - start) * 1000})
+        return response
@@ -16,3 +16,13 @@ class vSpherePropertyNotExist(BaseEx):
     
     def __str__(self):
         return self.message
+
+
+class vSphereInventoryError(BaseEx):
+    """The class for vsphere inventory could not be listed"""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
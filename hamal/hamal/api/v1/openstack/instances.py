@@ -17,6 +17,9 @@ class InstancesController(wsgi.Controller):
     
     def create(self, req, body):
         return self._get_instances_on_openstack(req, body)
+
+    def create_tasks(self, req, body):
+        return self._view_builder._task_batch_create(req, body)
     
     # backend resources operation
     def _get_allow_instance_numbers(self, req):
@@ -37,9 +37,15 @@ ROUTE_LIST = (
         'GET': [server_controller, 'index'],
         'POST': [server_controller, 'create']
     }),
+    ('/servers/tasks', {
+        'POST': [server_controller, 'create_tasks']
+    }),
     ('/instances', {
         'GET': [instance_controller, 'index'],
         'POST': [instance_controller, 'create']
+    }),
+    ('/instances/tasks', {
+        'POST': [instance_controller, 'create_tasks']
     })
 )
 
@@ -0,0 +1,306 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Incremental in-memory inventory of the virtual machines on a vcenter
+
+A watcher creates one PropertyCollector filter over every virtual machine of
+the vcenter and then only applies the deltas returned by WaitForUpdatesEx,
+so listing the virtual machines of an ESXi host is answered from memory
+instead of collecting the whole property set again.
+"""
+
+import collections
+import threading
+import time
+
+from oslo_log import log as logging
+from pyVim import connect
+from pyVmomi import vmodl
+
+from hamal.api.v1.vmware.driver.session_pool import session_key
+from hamal.api.v1.vmware.driver.vsphere import vSphere
+from hamal.i18n import _LE, _LI
+import hamal.conf
+
+
+LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+# The property path which indexes virtual machines by ESXi host
+HOST_PROPERTY = 'runtime.host'
+
+_WATCHERS = {}
+_WATCHERS_LOCK = threading.Lock()
+
+
+class InventoryWatcher(vSphere):
+    """Keep a host indexed table of the virtual machines of a vcenter
+
+    The watcher holds its own session instead of one from the session pool,
+    because a PropertyCollector filter belongs to the session which created
+    it and lives as long as the watcher.
+    """
+
+    def __init__(self, properties, *args, **kwargs):
+        super(InventoryWatcher, self).__init__(*args, **kwargs)
+        self._properties = list(properties)
+        if HOST_PROPERTY not in self._properties:
+            self._properties.append(HOST_PROPERTY)
+
+        self._lock = threading.Lock()
+        self._vms = {}
+        self._vms_by_host = collections.defaultdict(set)
+        self._collector = None
+        self._synced = False
+        self._refresh = False
+        self._running = False
+        self._thread = None
+
+        # The version of the last update set applied, as returned by
+        # WaitForUpdatesEx, and a counter which is increased every time
+        # the table changes.
+        self.version = ''
+        self.generation = 0
+        self.last_sync = 0
+        self.last_read = time.time()
+
+    def connect(self):
+        self.si = self._login()
+
+    def disconnect(self):
+        if self.si:
+            try:
+                connect.Disconnect(self.si)
+            except Exception:
+                LOG.debug("Could not disconnect the inventory watcher of %s",
+                          self._host)
+            self.si = None
+
+    @property
+    def properties(self):
+        return list(self._properties)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='inventory-%s' % self._host)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._cancel_wait()
+
+    def refresh(self):
+        """Drop the table and collect the whole inventory again"""
+        self._refresh = True
+        self._cancel_wait()
+
+    def _cancel_wait(self):
+        collector = self._collector
+        if collector is None:
+            return
+        try:
+            collector.CancelWaitForUpdates()
+        except Exception:
+            LOG.debug("Could not cancel WaitForUpdatesEx on %s", self._host)
+
+    def _reset(self):
+        with self._lock:
+            self._vms = {}
+            self._vms_by_host = collections.defaultdict(set)
+            self._synced = False
+            self.version = ''
+            self.generation += 1
+
+    def _create_collector(self):
+        content = self.si.content
+        # NOTE(jackdan): A private collector keeps our filter away from the
+        # filters of other clients sharing the session's default collector.
+        collector = content.propertyCollector.CreatePropertyCollector()
+        props = self._parse_propspec({'VirtualMachine': self._properties})
+        filter_spec = self._create_filter_spec([content.rootFolder], props)
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        return collector
+
+    def _idle(self):
+        return time.time() - self.last_read > CONF.vmware.inventory_cache_idle_timeout
+
+    def _give_up(self):
+        """Stops the watcher and unregisters it, from its own thread
+
+        The table is dropped as well, so the callers holding the watcher
+        collect from vcenter right away instead of reading a dead table.
+        """
+        self._running = False
+        self._reset()
+        _forget(self)
+
+    def _run(self):
+        backoff = 1
+        failures = 0
+        while self._running:
+            if self._idle():
+                LOG.info(_LI("Inventory watcher of %(host)s is idle."),
+                         {'host': self._host})
+                self._give_up()
+                break
+            try:
+                self.connect()
+                if self.si is None:
+                    raise Exception("Could not connect to vcenter %s" % self._host)
+                self._collector = self._create_collector()
+                self._reset()
+                failures = 0
+                self._watch()
+                backoff = 1
+            except Exception as e:
+                if not self._running:
+                    break
+                LOG.exception(_LE("Inventory watcher of %(host)s failed: %(e)s"),
+                              {'host': self._host, 'e': e})
+                self._reset()
+                failures += 1
+                if failures >= CONF.vmware.inventory_max_retries:
+                    # NOTE(jackdan): The credential may have been changed,
+                    # logging in again with it could lock the account.
+                    LOG.error(_LE("Inventory watcher of %(host)s gave up after "
+                                  "%(failures)d failures."),
+                              {'host': self._host, 'failures': failures})
+                    self._give_up()
+                    break
+                time.sleep(backoff)
+                backoff = min(backoff * 2, CONF.vmware.inventory_wait_seconds)
+            finally:
+                collector, self._collector = self._collector, None
+                if collector is not None:
+                    try:
+                        collector.Destroy()
+                    except Exception:
+                        pass
+                self.disconnect()
+
+        LOG.info(_LI("Inventory watcher of %(host)s stopped."), {'host': self._host})
+
+    def _watch(self):
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=CONF.vmware.inventory_wait_seconds,
+            maxObjectUpdates=CONF.vmware.property_collector_max_objects)
+
+        while self._running:
+            if self._idle():
+                LOG.info(_LI("Inventory watcher of %(host)s is idle."),
+                         {'host': self._host})
+                self._give_up()
+                return
+
+            if self._refresh:
+                self._refresh = False
+                return
+
+            try:
+                update_set = self._collector.WaitForUpdatesEx(self.version, options)
+            except vmodl.fault.RequestCanceled:
+                continue
+
+            if update_set is None:
+                # No change within maxWaitSeconds, the table is still current
+                if self._synced:
+                    self.last_sync = time.time()
+                continue
+
+            self._apply(update_set)
+
+    def _apply(self, update_set):
+        with self._lock:
+            for filter_update in update_set.filterSet or []:
+                for obj_update in filter_update.objectSet or []:
+                    self._apply_object(obj_update)
+
+            self.version = update_set.version
+            self.generation += 1
+            # NOTE(jackdan): The initial update set may be split into several
+            # truncated ones, the table is complete after the last of them.
+            if not update_set.truncated:
+                self._synced = True
+                self.last_sync = time.time()
+
+    def _apply_object(self, obj_update):
+        moid = obj_update.obj._moId
+
+        if obj_update.kind == 'leave':
+            vm = self._vms.pop(moid, None)
+            if vm is not None:
+                self._unindex(moid, vm)
+            return
+
+        vm = self._vms.setdefault(moid, {})
+        self._unindex(moid, vm)
+        for change in obj_update.changeSet or []:
+            if change.op in ('remove', 'indirectRemove'):
+                vm.pop(change.name, None)
+            else:
+                vm[change.name] = change.val
+        host = vm.get(HOST_PROPERTY)
+        if host is not None:
+            self._vms_by_host[host._moId].add(moid)
+
+    def _unindex(self, moid, vm):
+        host = vm.get(HOST_PROPERTY)
+        if host is not None:
+            self._vms_by_host[host._moId].discard(moid)
+
+    def is_fresh(self, max_staleness=None):
+        if max_staleness is None:
+            max_staleness = CONF.vmware.inventory_cache_max_staleness
+        return self._synced and time.time() - self.last_sync <= max_staleness
+
+    def servers_on_host(self, host, max_staleness=None):
+        """Returns the virtual machines on host from memory
+
+        :param host: The HostSystem object, or its managed object id
+        :param max_staleness: The maximum age in seconds of the table,
+            default is ``[vmware] inventory_cache_max_staleness``
+        :returns: list of dict which maps property path to its value, or
+            None if the table is not synced or older than max_staleness
+        """
+        self.last_read = time.time()
+        if not self.is_fresh(max_staleness):
+            return None
+
+        host_moid = getattr(host, '_moId', host)
+        with self._lock:
+            return [dict(self._vms[moid])
+                    for moid in self._vms_by_host.get(host_moid, ())]
+
+
+def _forget(watcher):
+    with _WATCHERS_LOCK:
+        for key, value in list(_WATCHERS.items()):
+            if value is watcher:
+                del _WATCHERS[key]
+
+
+def get_watcher(host, user, pwd, properties, port=443):
+    """Returns the running inventory watcher of a vcenter
+
+    The watcher is registered and started on the first call for a vcenter
+    and credential. None is returned if the inventory cache is disabled or
+    the watcher does not collect all of the properties.
+    """
+    if not CONF.vmware.inventory_cache_enabled:
+        return None
+
+    key = session_key(host, port, user, pwd)
+    with _WATCHERS_LOCK:
+        watcher = _WATCHERS.get(key)
+        if watcher is None:
+            watcher = InventoryWatcher(properties, host=host, port=port,
+                                       user=user, pwd=pwd)
+            _WATCHERS[key] = watcher
+            watcher.start()
+
+    if not set(properties).issubset(watcher.properties):
+        return None
+    return watcher
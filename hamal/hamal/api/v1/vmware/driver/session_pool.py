@@ -0,0 +1,221 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Pool of logged in vcenter sessions
+
+A vcenter login takes seconds on a busy vcenter and every session counts
+against its session limit, so sessions are kept after use and handed to the
+next request for the same vcenter and credential. Idle sessions are kept
+alive by a periodic heartbeat and evicted once they have been idle for too
+long. A session which has expired on vcenter is dropped on checkout and
+replaced by a new login.
+"""
+
+import collections
+import hashlib
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_service import loopingcall
+from pyVim import connect
+
+from hamal.i18n import _LI, _LW
+import hamal.conf
+
+
+LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+
+def session_key(host, port, user, pwd):
+    """Returns the pool key of a vcenter credential
+
+    The password is only kept as a digest, so the key can be logged and
+    held in memory safely.
+    """
+    pwd = pwd or ''
+    credential = hashlib.sha256(pwd.encode('utf-8')).hexdigest()
+    return (host, int(port), user, credential)
+
+
+class SessionPool(object):
+    """Check out and check in vcenter sessions keyed by credential"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> deque of (service_instance, last_used_timestamp)
+        self._idle = collections.defaultdict(collections.deque)
+        # id(service_instance) -> dict, data memoized for the session
+        self._session_caches = {}
+        self._heartbeat = None
+        self._hits = 0
+        self._misses = 0
+        self._logins = 0
+        self._login_failures = 0
+        self._login_time = 0.0
+        self._login_time_max = 0.0
+        self._evictions = 0
+        self._expired = 0
+
+    @staticmethod
+    def _is_alive(si):
+        try:
+            return si.content.sessionManager.currentSession is not None
+        except Exception:
+            return False
+
+    def session_cache(self, si):
+        """Returns the dict of data memoized for the session of si
+
+        Managed object references are bound to the session which looked
+        them up, so they are only memoized until the session is logged out.
+        """
+        with self._lock:
+            return self._session_caches.setdefault(id(si), {})
+
+    def _logout(self, si):
+        with self._lock:
+            self._session_caches.pop(id(si), None)
+        try:
+            connect.Disconnect(si)
+        except Exception:
+            LOG.warning(_LW("Could not disconnect the vcenter session."))
+
+    def checkout(self, key, login):
+        """Returns an idle session of key, or a new one from login
+
+        :param key: The pool key returned from ``session_key``
+        :param login: Callable which logs in to vcenter and returns the
+            service instance, or None when the login failed
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                si = idle.pop()[0] if idle else None
+            if si is None:
+                break
+            if self._is_alive(si):
+                with self._lock:
+                    self._hits += 1
+                return si
+            with self._lock:
+                self._expired += 1
+            LOG.info(_LI("Idle vcenter session of %(host)s has expired, "
+                         "log in again."), {'host': key[0]})
+            self._logout(si)
+
+        start = time.time()
+        si = login()
+        elapsed = time.time() - start
+        with self._lock:
+            self._misses += 1
+            if si is None:
+                self._login_failures += 1
+            else:
+                self._logins += 1
+                self._login_time += elapsed
+                self._login_time_max = max(self._login_time_max, elapsed)
+        self._ensure_heartbeat()
+        return si
+
+    def checkin(self, key, si):
+        """Returns a checked out session to the pool"""
+        if si is None:
+            return
+
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < CONF.vmware.session_pool_max_idle:
+                idle.append((si, time.time()))
+                return
+            self._evictions += 1
+        self._logout(si)
+
+    def heartbeat(self):
+        """Keep idle sessions alive and evict the stale ones"""
+        now = time.time()
+        with self._lock:
+            idle_sessions = [(key, session) for key, idle in self._idle.items()
+                             for session in idle]
+            self._idle.clear()
+
+        alive = []
+        for key, (si, last_used) in idle_sessions:
+            if now - last_used > CONF.vmware.session_idle_timeout:
+                with self._lock:
+                    self._evictions += 1
+                self._logout(si)
+                continue
+            try:
+                # NOTE(jackdan): Any authenticated call resets the idle timer
+                # of the session on vcenter, CurrentTime is the cheapest one.
+                si.CurrentTime()
+            except Exception:
+                with self._lock:
+                    self._expired += 1
+                self._logout(si)
+                continue
+            alive.append((key, (si, last_used)))
+
+        with self._lock:
+            for key, session in alive:
+                self._idle[key].append(session)
+
+        self.log_stats()
+
+    def log_stats(self):
+        """Logs the metrics of the pool at INFO, once the pool was used"""
+        stats = self.stats()
+        if not stats['checkouts']:
+            return
+        LOG.info(_LI("vCenter session pool: %(checkouts)d checkouts, hit rate "
+                     "%(hit_rate).1f%%, %(logins)d logins (%(login_failures)d "
+                     "failed), login latency avg %(login_avg).0fms max "
+                     "%(login_max).0fms, %(idle_sessions)d idle sessions, "
+                     "%(evictions)d evicted, %(expired)d expired."),
+                 dict(stats, hit_rate=stats['hit_rate'] * 100,
+                      login_avg=stats['login_latency_avg'] * 1000,
+                      login_max=stats['login_latency_max'] * 1000))
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat is not None:
+            return
+
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            interval = CONF.vmware.session_keepalive_interval
+            self._heartbeat = loopingcall.FixedIntervalLoopingCall(self.heartbeat)
+            self._heartbeat.start(interval=interval, initial_delay=interval)
+
+    def clear(self):
+        """Log out every idle session"""
+        with self._lock:
+            idle_sessions = [session for idle in self._idle.values()
+                             for session in idle]
+            self._idle.clear()
+        for si, _last_used in idle_sessions:
+            self._logout(si)
+
+    def stats(self):
+        """Returns the metrics of the pool"""
+        with self._lock:
+            checkouts = self._hits + self._misses
+            return {
+                'checkouts': checkouts,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': checkouts and float(self._hits) / checkouts,
+                'logins': self._logins,
+                'login_failures': self._login_failures,
+                'login_latency_avg': (self._logins and
+                                      self._login_time / self._logins),
+                'login_latency_max': self._login_time_max,
+                'evictions': self._evictions,
+                'expired': self._expired,
+                'idle_sessions': sum(len(idle) for idle in self._idle.values())
+            }
+
+
+SESSION_POOL = SessionPool()
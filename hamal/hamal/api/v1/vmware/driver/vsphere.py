@@ -10,11 +10,16 @@ from pyVmomi import vmodl
 
 from hamal.api.v1.exceptions import vSpherePropertyNotExist
 from hamal.api.v1.vmware.driver.base import BaseDriver
-from hamal.api.v1.vmware.utils.service_util import build_full_traversal
-from hamal.i18n import _LI, _LE
+from hamal.api.v1.vmware.driver.session_pool import SESSION_POOL
+from hamal.api.v1.vmware.driver.session_pool import session_key
+from hamal.api.v1.vmware.utils.service_util import FULL_TRAVERSAL
+from hamal.api.v1.vmware.utils.service_util import VIEW_TRAVERSAL
+from hamal.i18n import _LI, _LE, _LW
+import hamal.conf
 
 
 LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
 
 
 class VMwareDriver(BaseDriver):
@@ -34,12 +39,15 @@ class VMwareDriver(BaseDriver):
             except ValueError:
                 LOG.error(_LI("The type of port should be integer."))
                 raise ValueError("The type of port should be integer.")
+
+        self._session_key = session_key(self._host, self._port, self._user, self._pwd)
     
-    def connect(self):
+    def _login(self):
+        si = None
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
         # ssl_context.verify_mode = ssl.CERT_NONE
         try:
-            self.si = connect.SmartConnect(
+            si = connect.SmartConnect(
                 host=self._host,
                 port=self._port,
                 user=self._user,
@@ -49,7 +57,7 @@ class VMwareDriver(BaseDriver):
             )
         except ssl.SSLError:
             try:
-                self.si = connect.SmartConnectNoSSL(
+                si = connect.SmartConnectNoSSL(
                     host=self._host,
                     port=self._port,
                     user=self._user,
@@ -57,16 +65,27 @@ class VMwareDriver(BaseDriver):
                     **self._kwargs
                 )
             except Exception:
-                LOG.Exception(_LE("Exception connect to the specified vcenter using "
+                LOG.exception(_LE("Exception connect to the specified vcenter using "
                                   "specified username and password"))
         finally:
-            if self.si is None:
+            if si is None:
                 LOG.error(_LE("Could not connect to the specified vcenter using "
                               "specified username and password"))
-    
+        return si
+
+    def connect(self):
+        if not CONF.vmware.session_pool_enabled:
+            self.si = self._login()
+            return
+
+        self.si = SESSION_POOL.checkout(self._session_key, self._login)
+
     def disconnect(self):
         if self.si:
-            connect.Disconnect(self.si)
+            if CONF.vmware.session_pool_enabled:
+                SESSION_POOL.checkin(self._session_key, self.si)
+            else:
+                connect.Disconnect(self.si)
             self.si = None
     
     def __enter__(self):
@@ -82,6 +101,7 @@ class vSphere(VMwareDriver):
 
     def __init__(self, *args, **kwargs):
         super(vSphere, self).__init__(*args, **kwargs)
+        self._local_cache = {}
     
     def __enter__(self):
         self.connect()
@@ -90,6 +110,107 @@ class vSphere(VMwareDriver):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
+    @property
+    def _session_cache(self):
+        if CONF.vmware.session_pool_enabled:
+            return SESSION_POOL.session_cache(self.si)
+        return self._local_cache
+
+    def resolve_inventory_path(self, path):
+        """Returns the managed entity of an inventory path
+
+        The lookup is a single SearchIndex.FindByInventoryPath call and its
+        result is memoized for the session.
+
+        :param path: The inventory path, such as ``datacenter/host/cluster/esxi``
+        :type path: str
+        :returns: The managed entity, or None if path does not exist
+        """
+        if self.si is None:
+            return None
+
+        cache = self._session_cache
+        key = ('path', path)
+        if key not in cache:
+            entity = self.si.content.searchIndex.FindByInventoryPath(path)
+            if entity is None:
+                return None
+            cache[key] = entity
+        return cache[key]
+
+    def find_host(self, datacenter, host_name):
+        """Returns the HostSystem named host_name in datacenter
+
+        The host is looked up by DNS name and then by IP address, both of
+        which are answered by the SearchIndex without walking the inventory.
+        The result is memoized for the session.
+        """
+        if self.si is None:
+            return None
+
+        cache = self._session_cache
+        key = ('host', datacenter._moId, host_name)
+        if key not in cache:
+            search_index = self.si.content.searchIndex
+            host = search_index.FindByDnsName(datacenter=datacenter,
+                                              dnsName=host_name,
+                                              vmSearch=False)
+            if host is None:
+                try:
+                    host = search_index.FindByIp(datacenter=datacenter,
+                                                 ip=host_name,
+                                                 vmSearch=False)
+                except vmodl.fault.InvalidArgument:
+                    host = None
+            if host is None:
+                return None
+            cache[key] = host
+        return cache[key]
+
+    def resolve_uri(self, uri):
+        """Resolve a ``datacenter/[cluster/]esxi`` uri to managed entities
+
+        A ``datacenter/cluster`` uri resolves to the ClusterComputeResource,
+        which can be used as container of the virtual machines as well.
+
+        The uri is first resolved as an inventory path below the host folder
+        of the datacenter, then the ESXi is searched by name in the whole
+        datacenter, so a large estate costs a constant number of round trips.
+
+        :param uri: The uri of ESXi, without leading and trailing '/'
+        :type uri: str
+        :returns: tuple of (datacenter, host), each of them is None if it
+            could not be found. host is a HostSystem or ClusterComputeResource
+        """
+        parts = uri.split('/')
+        datacenter = self.resolve_inventory_path(parts[0])
+        if not isinstance(datacenter, vim.Datacenter):
+            return None, None
+
+        host = None
+        if len(parts) > 1:
+            path = '/'.join([parts[0], 'host'] + parts[1:])
+            host = self.resolve_inventory_path(path)
+            # NOTE(jackdan): The inventory path of a standalone ESXi ends at
+            # its ComputeResource, which holds that single host.
+            if (isinstance(host, vim.ComputeResource) and
+                    not isinstance(host, vim.ClusterComputeResource) and
+                    len(host.host) == 1):
+                host = host.host[0]
+        if isinstance(host, vim.ClusterComputeResource):
+            return datacenter, host
+        if not isinstance(host, vim.HostSystem):
+            host = self.find_host(datacenter, parts[-1])
+        if host is None:
+            LOG.debug("Could not resolve %s directly, scan the datacenter.", uri)
+            for candidate in self.get_container_view(datacenter, [vim.HostSystem]):
+                if candidate.name == parts[-1]:
+                    host = candidate
+                    self._session_cache[('host', datacenter._moId, parts[-1])] = host
+                    break
+
+        return datacenter, host
+
     @staticmethod
     def _parse_propspec(propspec):
         """Parses property specifications
@@ -112,17 +233,8 @@ class vSphere(VMwareDriver):
         return props
     
     @staticmethod
-    def _create_filter_spec(objs, props):
-        """Returns filterSpec object"""
-
-        obj_specs = []
+    def _create_prop_specs(props):
         prop_specs = []
-        traversal = build_full_traversal()
-        for obj in objs:
-            obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=obj,
-                                                                selectSet=traversal)
-            obj_specs.append(obj_spec)
-        
         for mo_type, prop_list in props:
             # param all: bool
             # Specifies whether or not all properties of the object are read.
@@ -131,11 +243,55 @@ class vSphere(VMwareDriver):
                                                                    type=mo_type,
                                                                    pathSet=prop_list)
             prop_specs.append(prop_spec)
+        return prop_specs
+
+    @staticmethod
+    def _create_filter_spec(objs, props):
+        """Returns filterSpec object
+
+        Every object is a root of the full traversal.
+        """
+
+        obj_specs = []
+        for obj in objs:
+            obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=obj,
+                                                                selectSet=FULL_TRAVERSAL)
+            obj_specs.append(obj_spec)
+        
         filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs,
-                                                               propSet=prop_specs)
+                                                               propSet=vSphere._create_prop_specs(props))
         
         return filter_spec
-    
+
+    @staticmethod
+    def _create_view_filter_spec(view, props):
+        """Returns filterSpec object which collects the objects of a view
+
+        The ContainerView is the single root and is skipped itself, the
+        objects are reached by one hop through its 'view' property, so every
+        object is visited and returned exactly once.
+        """
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view,
+                                                            skip=True,
+                                                            selectSet=VIEW_TRAVERSAL)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec],
+                                                               propSet=vSphere._create_prop_specs(props))
+
+        return filter_spec
+
+    def create_container_view(self, container=None, object_type=None, recursive=True):
+        """Returns a ContainerView, the caller should destroy it after use
+
+        See ``get_container_view`` for the parameters.
+        """
+        if self.si is None:
+            return
+        
+        container = container or self.si.content.rootFolder
+        return self.si.content.viewManager.CreateContainerView(
+            container, object_type, recursive
+        )
+
     def get_container_view(self, container=None, object_type=None, recursive=True):
         """Returns the container view of specified object type
 
@@ -151,58 +307,136 @@ class vSphere(VMwareDriver):
                 following paths beyond the immedidate children.
         :type recursive: Bool
         """
-        if self.si is None:
+        container_view = self.create_container_view(container, object_type, recursive)
+        if container_view is None:
             return
         
-        container = container or self.si.content.rootFolder
-        container_view = self.si.content.viewManager.CreateContainerView(
-            container, object_type, recursive
-        )
         view = container_view.view
         container_view.Destroy()
         return view
     
-    def _do_property_collector(self, objs, props, max_objecs=100):
-        """Really do properties collector using RetrievePropertiesEx
+    def _iter_property_pages(self, filter_spec, max_objects=None):
+        """Iterate the pages returned by RetrievePropertiesEx
 
-        :param objs: The objects will be queried
-        :param props: The properties of objects will be queried
+        The continuation token is followed iteratively, so only one page of
+        ObjectContent data objects is held in memory at a time and a long
+        chain of tokens never grows the stack. If the caller stops consuming
+        before the last page, the pending retrieval is cancelled on vcenter.
+
+        :param filter_spec: The filterSpec object of the objects and properties
         :param max_objects: The maximum number of ObjectContent data objects that should
-        be returned in a single result from RetrievePropertiesEx. The default is 100
+        be returned in a single result from RetrievePropertiesEx. The default is
+        ``[vmware] property_collector_max_objects``
+        :returns: generator of ObjectContent lists, one list per page
         """
         if self.si is None:
             return
-        
+
+        max_objects = max_objects or CONF.vmware.property_collector_max_objects
         pc = self.si.content.propertyCollector
-        filter_spec = self._create_filter_spec(objs, props)
-        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=max_objecs)
+        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=max_objects)
         result = pc.RetrievePropertiesEx([filter_spec], options)
 
-        # Because the maximum number of objects retrieved by RetrievePropertiesEx
-        # and ContinueRetrievePropertiesEx were limit to 100. So, we need ti 
-        # continue retrieve properties using token
-
-        def _continue(token=None):
-            _result = pc.ContinueRetrievePropertiesEx(token)
-            _token = _result.token
-            _objects = _result.objects
-            if _token is not None:
-                _objects_ex = _continue(_token)
-                _objects.extend(_objects_ex)
-            return _objects
-        
-        if result is None:
-            return []
-        
-        token = result.token
-        objects = result.objects
-        if token is not None:
-            _objects = _continue(token)
-            objects.extend(_objects)
-        
-        return objects
-    
-    def property_collector(self, container=None, object_type=None, property_spec=None):
+        token = None
+        try:
+            while result is not None:
+                token = result.token
+                yield result.objects
+                if token is None:
+                    break
+                result = pc.ContinueRetrievePropertiesEx(token)
+                token = None
+        finally:
+            if token is not None:
+                try:
+                    pc.CancelRetrievePropertiesEx(token)
+                except Exception:
+                    LOG.warning(_LW("Could not cancel the property collector "
+                                    "retrieval with token %(token)s."),
+                                {'token': token})
+
+    def _do_property_collector(self, objs, props, max_objects=None):
+        """Really do properties collector using RetrievePropertiesEx
+
+        :param objs: The objects will be queried
+        :param props: The properties of objects will be queried
+        :param max_objects: The maximum number of ObjectContent data objects that should
+        be returned in a single result from RetrievePropertiesEx.
+        :returns: generator of ObjectContent data objects
+        """
+        filter_spec = self._create_filter_spec(objs, props)
+        for objects in self._iter_property_pages(filter_spec, max_objects):
+            for obj in objects:
+                yield obj
+
+    def _do_view_property_collector(self, view, props, max_objects=None):
+        """Really do properties collector of the objects of a ContainerView
+
+        :param view: The ContainerView whose objects will be queried
+        :param props: The properties of objects will be queried
+        :param max_objects: The maximum number of ObjectContent data objects that should
+        be returned in a single result from RetrievePropertiesEx.
+        :returns: generator of ObjectContent data objects
+        """
+        filter_spec = self._create_view_filter_spec(view, props)
+        for objects in self._iter_property_pages(filter_spec, max_objects):
+            for obj in objects:
+                yield obj
+
+    def property_collector_iter(self, container=None, object_type=None, property_spec=None,
+                                max_objects=None):
+        """Lazily retrieve specified properties of specified objects
+
+        Same as ``property_collector`` but yields one dict per object as the
+        pages arrive from vcenter, so the peak memory does not grow with the
+        size of the inventory. The vSphere session must stay connected until
+        the generator is exhausted.
+
+        :param container: A reference to an instance of a Folder, Datacenter,
+                ResourcePool or HostSystem object.
+        :type container: ManagedEntity Object
+        :param object_type: An optional list of managed entity types.
+        :type object_type: List
+        :param property_spec: The property specifications need to be parsed.
+        :type property_spec: dict
+        :param max_objects: The page size of RetrievePropertiesEx.
+        :type max_objects: int
+        :return: generator of dict which maps property path to its value.
+        """
+        # The type of object_type must be list
+        if not isinstance(object_type, list):
+            object_type = [object_type]
+
+        props = self._parse_propspec(property_spec)
+        view = None
+        if CONF.vmware.property_collector_mode == 'view':
+            # NOTE(jackdan): The view has to be alive until the last page has
+            # been retrieved, the server walks it while paging.
+            view = self.create_container_view(container=container, object_type=object_type)
+            objects = self._do_view_property_collector(view, props, max_objects)
+        else:
+            objs = self.get_container_view(container=container, object_type=object_type)
+            objects = self._do_property_collector(objs, props, max_objects)
+
+        try:
+            for obj in objects:
+                value = dict()
+                for prop in obj.propSet:
+                    value[prop.name] = prop.val
+                yield value
+        except vmodl.query.InvalidProperty:
+            LOG.error(_LE("Query invalid property"))
+            raise
+        finally:
+            objects.close()
+            if view is not None:
+                try:
+                    view.Destroy()
+                except Exception:
+                    LOG.warning(_LW("Could not destroy the container view."))
+
+    def property_collector(self, container=None, object_type=None, property_spec=None,
+                           max_objects=None):
         """Retrieve specified properties of  specified objects
 
         :param container: A reference to an instance of a Folder, Datacenter,
@@ -214,6 +448,8 @@ class vSphere(VMwareDriver):
         :type object_type: List
         :param property_spec: The property specifications need to be parsed.
         :type property_spec: dict
+        :param max_objects: The page size of RetrievePropertiesEx.
+        :type max_objects: int
         :return: The ObjectContent data objects which retrieved from RetrievePropertiesEx.
 
         :useage
@@ -225,21 +461,5 @@ class vSphere(VMwareDriver):
                 }
                 objects = vs.property_collector(container, object_type, prop_spec)
         """
-        # The type of object_type must be list
-        if not isinstance(object_type, list):
-            object_type = [object_type]
-        
-        objs = self.get_container_view(container=container, object_type=object_type)
-        props = self._parse_propspec(property_spec)
-        result = []
-        try:
-            objects = self._do_property_collector(objs, props)
-        except vmodl.query.InvalidProperty:
-            LOG.error(_LE("Query invalid property"))
-            raise
-        for obj in objects:
-            value = dict()
-            for prop in obj.propSet:
-                value[prop.name] = prop.val
-            result.append(value)
-        return result
+        return list(self.property_collector_iter(container, object_type,
+                                                 property_spec, max_objects))
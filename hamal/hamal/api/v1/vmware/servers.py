@@ -18,6 +18,9 @@ class ServersController(wsgi.Controller):
     def create(self, req, body):
         return self._get_servers_on_esxi(req, body)
 
+    def create_tasks(self, req, body):
+        return self._view_builder._task_batch_create(req, body)
+
     # backend resources operation
     def _get_allow_server_numbers(self, req):
         return self._view_builder._allow_server_numbers(req)
@@ -0,0 +1,116 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Utility function for the virtual devices of a virtual machine
+
+All of the checks are done on the device types, the property paths needed
+for the disk detail are listed in DISK_PROPERTIES so that the details of
+every virtual machine of a host or cluster are collected in one pass.
+"""
+
+from pyVmomi import vim
+
+
+# The property paths needed by disk_details
+DISK_PROPERTIES = ["config.hardware.device", "layoutEx.disk", "layoutEx.file"]
+
+# NOTE(jackdan): Subclasses must be listed before their base classes,
+# VirtualLsiLogicSASController is not a VirtualLsiLogicController but
+# both are VirtualSCSIController.
+CONTROLLER_TYPES = (
+    (vim.vm.device.ParaVirtualSCSIController, 'pvscsi'),
+    (vim.vm.device.VirtualLsiLogicSASController, 'lsilogic-sas'),
+    (vim.vm.device.VirtualLsiLogicController, 'lsilogic'),
+    (vim.vm.device.VirtualBusLogicController, 'buslogic'),
+    (vim.vm.device.VirtualSCSIController, 'scsi'),
+    (vim.vm.device.VirtualIDEController, 'ide'),
+    (vim.vm.device.VirtualSATAController, 'sata'),
+    (vim.vm.device.VirtualNVMEController, 'nvme'),
+)
+
+
+def is_disk(device):
+    return isinstance(device, vim.vm.device.VirtualDisk)
+
+
+def disk_number(devices):
+    """Returns the number of virtual disks in devices"""
+    return sum(1 for device in devices or [] if is_disk(device))
+
+
+def controller_type(controller):
+    """Returns the short name of the type of a controller"""
+    for device_type, name in CONTROLLER_TYPES:
+        if isinstance(controller, device_type):
+            return name
+    return None
+
+
+def provisioning_type(backing):
+    """Returns thin, thick-eager, thick-lazy or rdm of a disk backing"""
+    if isinstance(backing, vim.vm.device.VirtualDisk.RawDiskMappingVer1BackingInfo):
+        return 'rdm'
+    if getattr(backing, 'thinProvisioned', None):
+        return 'thin'
+    if getattr(backing, 'eagerlyScrub', None):
+        return 'thick-eager'
+    if hasattr(backing, 'thinProvisioned'):
+        return 'thick-lazy'
+    return None
+
+
+def datastore_name(backing):
+    """Returns the datastore name of a file backing
+
+    The name is parsed from the '[datastore] path' file name, so the
+    datastore object does not have to be fetched.
+    """
+    file_name = getattr(backing, 'fileName', None) or ''
+    if file_name.startswith('[') and ']' in file_name:
+        return file_name[1:file_name.index(']')]
+    return None
+
+
+def disk_details(devices, layout_disks=None, layout_files=None):
+    """Returns the detail of every virtual disk of a virtual machine
+
+    :param devices: The value of config.hardware.device
+    :param layout_disks: The value of layoutEx.disk
+    :param layout_files: The value of layoutEx.file
+    :returns: list of dict, one dict per virtual disk
+    """
+    devices = devices or []
+    controllers = dict((device.key, device) for device in devices
+                       if isinstance(device, vim.vm.device.VirtualController))
+    file_sizes = dict((layout_file.key, layout_file.size)
+                      for layout_file in layout_files or [])
+
+    # The allocated size of a disk is the size of all of the files of its
+    # chain, snapshot deltas included.
+    allocated = dict()
+    for layout_disk in layout_disks or []:
+        allocated[layout_disk.key] = sum(file_sizes.get(file_key, 0)
+                                         for chain in layout_disk.chain or []
+                                         for file_key in chain.fileKey or [])
+
+    disks = []
+    for device in devices:
+        if not is_disk(device):
+            continue
+        capacity = getattr(device, 'capacityInBytes', None) or device.capacityInKB * 1024
+        backing = device.backing
+        controller = controllers.get(device.controllerKey)
+        disks.append({
+            "label": device.deviceInfo.label if device.deviceInfo else None,
+            "key": device.key,
+            "unitNumber": device.unitNumber,
+            "capacityBytes": capacity,
+            "allocatedBytes": allocated.get(device.key),
+            "fileName": getattr(backing, 'fileName', None),
+            "datastore": datastore_name(backing),
+            "provisioning": provisioning_type(backing),
+            "controller": controller_type(controller),
+            "controllerBusNumber": getattr(controller, 'busNumber', None)
+        })
+
+    return disks
@@ -117,3 +117,23 @@ def  build_full_traversal():
     )
 
     return fullTraversal
+
+
+def build_view_traversal():
+    """
+    Builds a traversal spec that reaches the objects of a ContainerView
+    by one hop through its 'view' property.
+    """
+
+    TraversalSpec = vmodl.query.PropertyCollector.TraversalSpec
+
+    viewToObj = TraversalSpec(name='traverseView', type=vim.view.ContainerView,
+                              path='view', skip=False)
+
+    return [viewToObj]
+
+
+# NOTE(jackdan): The traversal specs never change, so they are built once
+# and shared by every filter spec instead of being rebuilt per collection.
+FULL_TRAVERSAL = build_full_traversal()
+VIEW_TRAVERSAL = build_view_traversal()
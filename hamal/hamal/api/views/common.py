@@ -0,0 +1,31 @@
+# Copyright 2020 Hamal, Inc.
+
+"""Helpers shared by the view builders"""
+
+
+def parse_pagination(req, body, max_limit):
+    """Returns the limit and marker of the request
+
+    The limit and marker are taken from the body or the query parameters.
+    The limit is capped at max_limit, and defaults to it when only a marker
+    is given. Both of them are None when the request is not paginated.
+
+    :raises: ValueError if the limit is not a positive integer
+    """
+    limit = body.get('limit')
+    if limit is None:
+        limit = req.params.get('limit')
+    marker = body.get('marker') or req.params.get('marker')
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if limit < 1:
+            raise ValueError("The limit should be a positive integer.")
+        limit = min(limit, max_limit)
+    elif marker is not None:
+        limit = max_limit
+
+    return limit, marker
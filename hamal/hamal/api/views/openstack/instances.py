@@ -3,23 +3,88 @@
 from __future__ import division
 
 import base64
+import collections
 import time
 import calendar
+import urllib.parse
 from dateutil import tz
 from datetime import datetime
 
+import eventlet
+from eventlet import semaphore
 from oslo_log import log as logging
+import six
 
+from hamal.api.views import common
+from hamal.api.views import tasks as tasks_view
+from hamal.db import api as db_api
+from hamal.i18n import _LE
 from hamal.openstack.instance import Instance
-from hamal.plugin.openstack import OpenstackPlugin
+from hamal.plugin import nova
+from hamal.plugin.openstack import get_plugin
+import hamal.conf
+
+
+LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+# The resources collected by the discovery of a source cloud
+DISCOVERY_RESOURCES = ('instances', 'volumes', 'ports')
+
+# The keys of the tenant of the discovered resources
+TENANT_KEYS = ('tenant_id', 'os-vol-tenant-attr:tenant_id', 'project_id')
+
+# The fields of a task of a batch and the task columns they are stored in
+TASK_FIELDS = collections.OrderedDict([
+    ('name', 'name'),
+    ('auth_url', 'auth_url'),
+    ('username', 'user'),
+    ('password', 'pwd'),
+    ('osp_network', 'osp_network'),
+    ('osp_flavor', 'osp_flavor'),
+    ('osp_storage', 'osp_storage'),
+    ('osp_hamal_type', 'osp_hamal_type')
+])
+TASK_REQUIRED_FIELDS = ('name', 'auth_url', 'username', 'password')
+
 
 class ViewBuilder(object):
     """A class for openstack instances"""
 
     def __init__(self):
         super(ViewBuilder, self).__init__()
-    
+
+    @staticmethod
+    def _parse_filters(req, body):
+        """Returns the nova filters of the request
+
+        The filters are taken from the query parameters and the ``filters``
+        dict of the body, the body wins.
+        """
+        filters = dict((key, value) for key, value in req.params.items()
+                       if key in nova.INSTANCE_FILTERS)
+        body_filters = body.get('filters') or {}
+        if not isinstance(body_filters, dict):
+            raise ValueError("The filters should be a dict.")
+
+        unknown = [key for key in body_filters if key not in nova.INSTANCE_FILTERS]
+        if unknown:
+            raise ValueError("Unknown filters %s, the filters should be in %s."
+                             % (', '.join(unknown), ', '.join(nova.INSTANCE_FILTERS)))
+        filters.update(body_filters)
+        return filters
+
     def _instance_list(self, req, body):
+        if body.get('discover', False):
+            return self._instance_discover(req, body)
+
+        try:
+            limit, marker = common.parse_pagination(req, body, CONF.openstack.instances_max_limit)
+            filters = self._parse_filters(req, body)
+        except ValueError as e:
+            LOG.error(_LE("Invalid instances request: %(e)s"), {'e': e})
+            return {"msg": six.text_type(e)}
+
         auth_url = body['auth_url']
         username = body['username']
         password = body['password']
@@ -33,9 +98,123 @@ class ViewBuilder(object):
             'tenant_id': tenant_id
         }
 
-        source_plugin = OpenstackPlugin(**source_auth)
+        source_plugin = get_plugin(**source_auth)
+
+        if limit is None:
+            return {"instances": list(source_plugin.nova.iter_instances(filters=filters))}
+
+        instances, next_marker = source_plugin.nova.list_instances(filters=filters,
+                                                                   limit=limit,
+                                                                   marker=marker)
+        return {"instances": instances, "next_marker": next_marker}
+
+    @staticmethod
+    def _discover_job(admin_plugin, source_auth, semaphores, job):
+        """Collects a resource of a tenant in a region
+
+        The tenant is None when the resources of every tenant are collected
+        by the admin with all_tenants.
+        """
+        tenant_id, region, resource = job
+        if tenant_id is None:
+            plugin = admin_plugin
+        else:
+            plugin = get_plugin(**dict(source_auth, tenant_id=tenant_id))
+        nova_plugin, cinder_plugin, neutron_plugin = plugin.region_services(region)
+
+        if resource == 'instances':
+            service = nova_plugin
+            filters = {'all_tenants': 1} if tenant_id is None else None
+            fetch = lambda: list(nova_plugin.iter_instances(filters=filters))
+        elif resource == 'volumes':
+            service = cinder_plugin
+            filters = {'all_tenants': 1} if tenant_id is None else None
+            fetch = lambda: list(cinder_plugin.iter_volumes(filters=filters))
+        else:
+            service = neutron_plugin
+            filters = {'tenant_id': tenant_id} if tenant_id is not None else None
+            fetch = lambda: neutron_plugin.list_ports(filters=filters)
+
+        with semaphores[urllib.parse.urlsplit(service.host_url).netloc]:
+            return fetch()
+
+    def _instance_discover(self, req, body):
+        """Discover the instances, volumes and ports of a whole source cloud
+
+        With ``all_tenants`` (the default) the admin lists the resources of
+        every tenant at once, otherwise every project of ``tenants``, or of
+        keystone, is listed with a token of its own. Every region of
+        ``regions``, or of the catalog, is listed. The lists run
+        concurrently, at most ``[openstack] discovery_concurrency`` at a
+        time and ``[openstack] discovery_per_endpoint_concurrency`` per
+        endpoint. Every resource is tagged with its tenant_id and region.
+        """
+        resources = body.get('resources') or list(DISCOVERY_RESOURCES)
+        unknown = [resource for resource in resources if resource not in DISCOVERY_RESOURCES]
+        if unknown:
+            return {"msg": "Unknown resources %s, the resources should be in %s."
+                           % (', '.join(unknown), ', '.join(DISCOVERY_RESOURCES))}
+
+        source_auth = {
+            'cluster_name': 'source',
+            'auth_url': body['auth_url'],
+            'username': body['username'],
+            'password': body['password'],
+            'tenant_id': body['tenant_id']
+        }
+        admin_plugin = get_plugin(**source_auth)
+
+        regions = body.get('regions') or admin_plugin.regions('nova') or [None]
+        if body.get('all_tenants', True):
+            tenants = [None]
+        else:
+            tenants = body.get('tenants') or admin_plugin.list_projects()
+
+        semaphores = collections.defaultdict(
+            lambda: semaphore.Semaphore(CONF.openstack.discovery_per_endpoint_concurrency))
+
+        def _discover(job):
+            try:
+                return job, self._discover_job(admin_plugin, source_auth, semaphores, job), None
+            except Exception as e:
+                LOG.exception(_LE("Could not discover %(resource)s of tenant %(tenant)s "
+                                  "in region %(region)s."),
+                              {'resource': job[2], 'tenant': job[0], 'region': job[1]})
+                return job, [], six.text_type(e)
+
+        jobs = [(tenant_id, region, resource) for tenant_id in tenants
+                for region in regions for resource in resources]
+        result = collections.OrderedDict((resource, []) for resource in resources)
+        discovered_tenants = set()
+        errors = []
+
+        pool = eventlet.GreenPool(CONF.openstack.discovery_concurrency)
+        for (tenant_id, region, resource), items, error in pool.imap(_discover, jobs):
+            for item in items:
+                item_tenant_id = tenant_id
+                for key in TENANT_KEYS:
+                    item_tenant_id = item.get(key) or item_tenant_id
+                item['tenant_id'] = item_tenant_id
+                item['region'] = region
+                discovered_tenants.add(item_tenant_id)
+            result[resource].extend(items)
+            if error is not None:
+                errors.append({"tenant_id": tenant_id, "region": region,
+                               "resource": resource, "error": error})
+
+        result['tenants'] = sorted(tenant for tenant in discovered_tenants if tenant)
+        result['errors'] = errors
+        return result
 
-        instances = source_plugin.nova.get_list_instance()['servers']
+    def _task_batch_create(self, req, body):
+        """Creates the migration tasks of a batch of instances
 
-        return {"instances": instances}
-        
\ No newline at end of file
+        :param body: ``tasks`` holds the instances, the fields missing from
+            one of them are taken from the body
+        """
+        try:
+            parsed = tasks_view.parse_batch(body, TASK_FIELDS, TASK_REQUIRED_FIELDS)
+        except ValueError as e:
+            LOG.error(_LE("Invalid tasks request: %(e)s"), {'e': e})
+            return {"msg": six.text_type(e)}
+        return tasks_view.create_batch(parsed, db_api.openstack_task_create_bulk)
@@ -0,0 +1,106 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Batch creation of the migration tasks
+
+Shared by the task batches of the vmware servers and of the openstack
+instances. Every entry of the batch is reported on its own: an invalid or
+duplicate entry is skipped, the other entries are still created.
+"""
+
+from oslo_utils import uuidutils
+import six
+
+import hamal.conf
+
+
+CONF = hamal.conf.CONF
+
+# The length of the id column of the tasks
+TASK_ID_LENGTH = 36
+
+
+def _entry_error(task, entry, fields, required):
+    unknown = [key for key in entry if key not in fields and key != 'id']
+    if unknown:
+        return "Unknown fields %s." % ', '.join(sorted(unknown))
+
+    missing = [field for field in required if not task.get(field)]
+    if missing:
+        return "Missing fields %s." % ', '.join(missing)
+
+    invalid = [field for field in list(fields) + ['id']
+               if task.get(field) is not None and
+               not isinstance(task[field], six.string_types)]
+    if invalid:
+        return "The fields %s should be strings." % ', '.join(invalid)
+
+    if task.get('id') and len(task['id']) > TASK_ID_LENGTH:
+        return "The id should not be longer than %d." % TASK_ID_LENGTH
+    return None
+
+
+def parse_batch(body, fields, required):
+    """Returns the task columns of the entries of a batch
+
+    Every entry of ``tasks`` takes the fields it lacks from the body. An
+    entry without id gets a generated one.
+
+    :param fields: dict of the fields of an entry to the task columns
+    :param required: The fields every entry should have
+    :returns: A list of (columns, error) per entry, columns is None and
+        error the reason for an invalid entry
+    :raises: ValueError if the batch itself is invalid
+    """
+    entries = body.get('tasks')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("The tasks should be a non empty list.")
+    if len(entries) > CONF.tasks_batch_max_size:
+        raise ValueError("A batch should not have more than %d tasks."
+                         % CONF.tasks_batch_max_size)
+
+    defaults = dict((field, body[field]) for field in fields
+                    if body.get(field) is not None)
+    parsed = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            parsed.append((None, "The task should be a dict."))
+            continue
+
+        task = dict(defaults, **entry)
+        error = _entry_error(task, entry, fields, required)
+        if error is not None:
+            parsed.append((None, error))
+            continue
+
+        columns = dict((column, task.get(field)) for field, column in fields.items())
+        columns['id'] = task.get('id') or uuidutils.generate_uuid()
+        parsed.append((columns, None))
+    return parsed
+
+
+def create_batch(parsed, create_bulk):
+    """Creates the valid entries of a parsed batch with create_bulk
+
+    :returns: The ids of the created tasks and the result of every entry
+    """
+    tasks = [columns for columns, error in parsed if error is None]
+    skipped = iter(create_bulk(tasks) if tasks else ())
+
+    created = []
+    results = []
+    for index, (columns, error) in enumerate(parsed):
+        if error is not None:
+            results.append({'index': index, 'status': 'invalid', 'msg': error})
+            continue
+
+        result = {'index': index, 'id': columns['id'], 'name': columns['name']}
+        reason = next(skipped)
+        if reason is None:
+            created.append(columns['id'])
+            result['status'] = 'created'
+        else:
+            result['status'], result['msg'] = reason
+        results.append(result)
+
+    return {"created": created, "tasks": results}
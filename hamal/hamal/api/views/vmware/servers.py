@@ -3,15 +3,90 @@
 from __future__ import division
 
 import base64
+import bisect
+import collections
+import time
+
+import eventlet
+from eventlet import semaphore
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from pyVmomi import vim
+import six
+import webob
 
+from hamal.api.v1.exceptions import vSphereInventoryError
+from hamal.api.v1.vmware.driver import inventory
 from hamal.api.v1.vmware.driver.vsphere import vSphere
+from hamal.api.v1.vmware.utils import device_util
+from hamal.api.views import common
+from hamal.api.views import tasks as tasks_view
 from hamal.db import api as db_api
 from hamal.i18n import _, _LE, _LI, _LW, _LC
+import hamal.conf
 
 
 LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+# The output fields of a server and the vSphere property paths they are
+# built from, in the order of the output.
+SERVER_FIELDS = collections.OrderedDict([
+    ("name", ["name"]),
+    ("uuid", ["config.instanceUuid"]),
+    ("template", ["config.template"]),
+    ("guestFullName", ["guest.guestFullName"]),
+    ("hostName", ["guest.hostName"]),
+    ("ipAddress", ["guest.ipAddress"]),
+    ("numCPU", ["config.hardware.numCPU"]),
+    ("memoryGB", ["config.hardware.memoryMB"]),
+    ("diskGB", ["summary.storage.committed"]),
+    ("diskNum", ["config.hardware.device"]),
+    ("driver", ["config.hardware.device"]),
+    ("toolsStatus", ["guest.toolsStatus"]),
+    ("toolsRunningStatus", ["guest.toolsRunningStatus"]),
+    ("powerState", ["runtime.powerState"])
+])
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# The fields of a task of a batch and the task columns they are stored in
+TASK_FIELDS = collections.OrderedDict([
+    ("name", "name"),
+    ("vc", "vcenter"),
+    ("user", "user"),
+    ("pwd", "pwd"),
+    ("uri", "uri"),
+    ("osp_network", "osp_network"),
+    ("osp_flavor", "osp_flavor"),
+    ("osp_storage", "osp_storage"),
+    ("osp_hamal_type", "osp_hamal_type")
+])
+TASK_REQUIRED_FIELDS = ("name", "vc", "user", "pwd", "uri")
+
+# Templates are always filtered out, so config.template is always collected
+TEMPLATE_PROPERTY = "config.template"
+
+
+def server_properties(fields=None, disks=False):
+    """Returns the minimal property paths needed by the output fields
+
+    :param fields: The output fields, default is all of them
+    :param disks: Set True to add the properties of the disk detail
+    """
+    properties = [TEMPLATE_PROPERTY]
+    for field in fields or SERVER_FIELDS:
+        for prop in SERVER_FIELDS[field]:
+            if prop not in properties:
+                properties.append(prop)
+    if disks:
+        for prop in ["name", "config.instanceUuid"] + device_util.DISK_PROPERTIES:
+            if prop not in properties:
+                properties.append(prop)
+    return properties
+
+
+SERVER_PROPERTIES = server_properties()
 
 
 class ViewBuilder(object):
@@ -20,76 +95,378 @@ class ViewBuilder(object):
     def __init__(self):
         super(ViewBuilder, self).__init__()
     
-    def _server_detail(self, server):
+    def _server_detail(self, server, fields=None):
         if server is None:
             return {"server": {}}
         
-        # todo(jackdan): need to add driver mode of disk
         server_ref = {
-            "server": {
-                "name": server.get("name"),
-                "template": server.get("config.template"),
-                "guestFullName": server.get("guest.guestFullName"),
-                "hostName": server.get("guest.hostName"),
-                "ipAddress": server.get("guest.ipAddress"),
-                "numCPU": server.get("config.hardware.numCPU"),
-                "memoryGB": str(server.get("config.hardware.memoryMB") / 1024), # Default MB and Integer
-                "diskGB": str("%.2f" % (server.get("summary.storage.committed") / 1024**3)),
-                "diskNum": self._disk_number(server.get("config.hardware.device")),
-                "driver": None,
-                "toolsStatus": server.get("guest.toolsStatus"),
-                "toolsRunningStatus": server.get("guest.toolsRunningStatus"),
-                "powerState": server.get("runtime.powerState")
-            }
+            "server": dict((field, self._server_field(server, field))
+                           for field in fields or SERVER_FIELDS)
         }
 
         return server_ref
 
+    def _server_field(self, server, field):
+        if field == "memoryGB":
+            # Default MB and Integer
+            return str(server.get("config.hardware.memoryMB") / 1024)
+        if field == "diskGB":
+            return str("%.2f" % (server.get("summary.storage.committed") / 1024**3))
+        if field == "diskNum":
+            return self._disk_number(server.get("config.hardware.device"))
+        if field == "driver":
+            return self._disk_driver(server.get("config.hardware.device"))
+        return server.get(SERVER_FIELDS[field][0])
+
+    @staticmethod
+    def _parse_fields(req, body):
+        """Returns the requested output fields
+
+        The fields are taken from the ``fields`` query parameter or the
+        ``fields`` key of the body, either a comma separated string or a
+        list. None means all of the fields.
+        """
+        fields = body.get('fields') or req.params.get('fields')
+        if not fields:
+            return None
+        if isinstance(fields, six.string_types):
+            fields = fields.split(',')
+        fields = [field.strip() for field in fields if field.strip()]
+
+        unknown = [field for field in fields if field not in SERVER_FIELDS]
+        if unknown:
+            raise ValueError("Unknown fields %s, the fields should be in %s."
+                             % (', '.join(unknown), ', '.join(SERVER_FIELDS)))
+        return fields
+
+    @staticmethod
+    def _server_sort_key(server):
+        return (server.get('vc') or '', server.get('uri') or '',
+                server.get('name') or '', server.get('uuid') or '')
+
+    @staticmethod
+    def _disk_sort_key(disk):
+        return (disk.get('vc') or '', disk.get('uri') or '',
+                disk.get('server') or '', disk.get('server_uuid') or '')
+
+    @staticmethod
+    def _encode_marker(key):
+        return base64.urlsafe_b64encode(jsonutils.dump_as_bytes(list(key))).decode('ascii')
+
+    @staticmethod
+    def _decode_marker(marker):
+        try:
+            key = jsonutils.loads(base64.urlsafe_b64decode(str(marker)))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid marker %s." % marker)
+        if (not isinstance(key, list) or len(key) != 4 or
+                not all(isinstance(item, six.string_types) for item in key)):
+            raise ValueError("Invalid marker %s." % marker)
+        return tuple(key)
+
+    def _paginate(self, servers, limit, marker_key):
+        """Returns a page of servers and the marker of the next page
+
+        The servers are sorted by vcenter, uri, name and uuid, so the pages
+        are stable between requests. The marker is the opaque sort key of
+        the last server of the previous page, so the servers without uuid
+        and the servers listed by several targets are paged as well. The
+        page starts after the marker even if its server is gone.
+
+        :param marker_key: The decoded marker, None for the first page
+        """
+        servers.sort(key=self._server_sort_key)
+
+        start = 0
+        if marker_key is not None:
+            keys = [self._server_sort_key(server) for server in servers]
+            start = bisect.bisect_right(keys, marker_key)
+
+        page = servers[start:start + limit]
+        next_marker = None
+        if page and start + limit < len(servers):
+            next_marker = self._encode_marker(self._server_sort_key(page[-1]))
+        return page, next_marker
+
+    @staticmethod
+    def _parse_targets(body):
+        """Returns the targets of the request
+
+        Every item of ``targets`` takes vc, user, pwd and uri, the missing
+        ones are taken from the body. Without ``targets`` the body itself
+        is the only target.
+
+        :raises: ValueError if targets is not a list of objects
+        """
+        defaults = dict((key, body.get(key)) for key in ('vc', 'user', 'pwd', 'uri'))
+        if body.get('targets') is None:
+            return [defaults]
+        if not isinstance(body['targets'], list):
+            raise ValueError("The targets should be a list.")
+
+        targets = []
+        for index, target in enumerate(body['targets']):
+            if not isinstance(target, dict):
+                raise ValueError("The target %d should be an object." % index)
+            merged = dict(defaults)
+            merged.update(target)
+            targets.append(merged)
+        return targets
+
     def _server_list(self, req, body):
-        vc = body.get('vc')
-        user = body.get('user')
-        pwd = body.get('pwd')
-        uri = body.get('uri')
+        try:
+            fields = self._parse_fields(req, body)
+            limit, marker = common.parse_pagination(req, body, CONF.vmware.servers_max_limit)
+            marker_key = self._decode_marker(marker) if marker is not None else None
+            targets = self._parse_targets(body)
+        except ValueError as e:
+            LOG.error(_LE("Invalid servers request: %(e)s"), {'e': e})
+            return {"msg": six.text_type(e)}
 
-        servers = self._list_servers_on_exsi(vc, user, pwd, uri)
+        stream = body.get('stream', False)
+        if stream and limit is not None:
+            return {"msg": "The streamed servers could not be paginated."}
 
-        if not isinstance(servers, list):
-            return servers
-        
+        # The servers are sorted and paged by name and uuid
+        if limit is not None and fields is not None:
+            fields = fields + [field for field in ('name', 'uuid')
+                               if field not in fields]
+
+        options = {
+            'fields': fields,
+            'disks': body.get('disks', False),
+            'refresh': body.get('refresh', False)
+        }
+        multiple = body.get('targets') is not None
+
+        if stream:
+            return self._server_stream(targets, multiple, **options)
+
+        if multiple:
+            # NOTE(jackdan): vCenter returns the servers of a target unsorted,
+            # so every target of the page is collected in full. The targets
+            # sorted before the one of the marker hold no server of the page.
+            if marker_key is not None:
+                targets = [target for target in targets
+                           if (target['vc'] or '', target['uri'] or '') >= marker_key[:2]]
+            result = self._server_list_targets(targets, **options)
+        else:
+            servers, disks, _elapsed = self._collect_target(targets[0], **options)
+            if not isinstance(servers, list):
+                return servers
+            result = {"servers": servers}
+            if disks is not None:
+                result['disks'] = disks
+
+        if limit is not None:
+            result['servers'], next_marker = self._paginate(result['servers'],
+                                                            limit, marker_key)
+            result['next_marker'] = next_marker
+
+            # Only the disks of the servers of the page
+            if result.get('disks') is not None:
+                page_keys = set(self._server_sort_key(server)
+                                for server in result['servers'])
+                result['disks'] = [disk for disk in result['disks']
+                                   if self._disk_sort_key(disk) in page_keys]
+
+        return result
+
+    def _collect_target(self, target, fields=None, disks=False, refresh=False):
+        """Returns the servers, disks and elapsed time of a target
+
+        The servers are a fault dict when the target could not be collected.
+        """
+        start = time.time()
+        disks_list = [] if disks else None
+        servers = self._list_servers_on_exsi(target['vc'], target['user'],
+                                             target['pwd'], target['uri'],
+                                             detail=self._server_summary(fields, disks_list),
+                                             refresh=refresh,
+                                             properties=server_properties(fields, disks))
+        return servers, disks_list, time.time() - start
+
+    def _server_list_targets(self, targets, fields=None, disks=False, refresh=False):
+        """List servers on several ESXi, possibly of several vcenters
+
+        Targets are collected concurrently, at most ``[vmware] fanout_concurrency``
+        at a time and at most ``[vmware] fanout_per_vcenter_concurrency``
+        per vcenter.
+        """
+        semaphores = dict()
+        for target in targets:
+            if target['vc'] not in semaphores:
+                semaphores[target['vc']] = semaphore.Semaphore(
+                    CONF.vmware.fanout_per_vcenter_concurrency)
+
+        def _collect(target):
+            with semaphores[target['vc']]:
+                try:
+                    return (target,) + self._collect_target(target, fields, disks, refresh)
+                except Exception as e:
+                    LOG.exception(_LE("Could not list servers on %(vc)s %(uri)s."),
+                                  {'vc': target['vc'], 'uri': target['uri']})
+                    return target, {"msg": six.text_type(e)}, None, 0
+
+        pool = eventlet.GreenPool(CONF.vmware.fanout_concurrency)
         servers_list = []
-        for server in servers:
+        disks_list = []
+        targets_list = []
+        for target, servers, target_disks, elapsed in pool.imap(_collect, targets):
+            result = {
+                "vc": target['vc'],
+                "uri": target['uri'],
+                "elapsed": round(elapsed, 3),
+                "error": None,
+                "count": 0
+            }
+            if isinstance(servers, list):
+                for row in servers + (target_disks or []):
+                    row['vc'] = target['vc']
+                    row['uri'] = target['uri']
+                servers_list.extend(servers)
+                disks_list.extend(target_disks or [])
+                result['count'] = len(servers)
+            else:
+                result['error'] = servers.get('msg')
+            targets_list.append(result)
+
+        if disks:
+            return {"servers": servers_list, "disks": disks_list,
+                    "targets": targets_list}
+        return {"servers": servers_list, "targets": targets_list}
+
+    def _server_stream(self, targets, multiple, fields=None, disks=False, refresh=False):
+        """Returns a chunked NDJSON response of the servers
+
+        Every line is one JSON object, ``{"server": ...}`` or ``{"disk": ...}``
+        as soon as it is collected, ``{"error": ...}`` for a target which
+        could not be collected, and a final ``{"targets": ...}`` line with
+        the timing of every target. Targets are streamed one after another.
+        """
+
+        def _line(obj):
+            return jsonutils.dump_as_bytes(obj) + b'\n'
+
+        def _lines():
+            targets_list = []
+            for target in targets:
+                start = time.time()
+                disks_list = [] if disks else None
+                result = {"vc": target['vc'], "uri": target['uri'],
+                          "error": None, "count": 0}
+                servers = self._iter_servers_on_exsi(target['vc'], target['user'],
+                                                     target['pwd'], target['uri'],
+                                                     detail=self._server_summary(fields, disks_list),
+                                                     refresh=refresh,
+                                                     properties=server_properties(fields, disks))
+                try:
+                    for server in servers:
+                        rows = [("server", server)]
+                        if disks_list:
+                            rows.extend(("disk", disk) for disk in disks_list)
+                            del disks_list[:]
+                        for kind, row in rows:
+                            if multiple:
+                                row['vc'] = target['vc']
+                                row['uri'] = target['uri']
+                            yield _line({kind: row})
+                        result['count'] += 1
+                except vSphereInventoryError as e:
+                    result['error'] = e.message
+                    yield _line({"error": dict(result)})
+                except Exception as e:
+                    # NOTE(jackdan): The response has started, an error can
+                    # only be reported as a line of the stream.
+                    LOG.exception(_LE("Could not stream servers on %(vc)s %(uri)s."),
+                                  {'vc': target['vc'], 'uri': target['uri']})
+                    result['error'] = six.text_type(e)
+                    yield _line({"error": dict(result)})
+                result['elapsed'] = round(time.time() - start, 3)
+                targets_list.append(result)
+            yield _line({"targets": targets_list})
+
+        return webob.Response(status=200, content_type=NDJSON_CONTENT_TYPE,
+                              charset=None, app_iter=_lines())
+
+    def _server_summary(self, fields=None, disks=None):
+        """Returns a callable which formats a server, or None for templates
+
+        When disks is a list, the detail of every virtual disk of the
+        servers is appended to it, one row per disk.
+        """
+
+        def _summary(server):
+            if server.get(TEMPLATE_PROPERTY, False):
+                return None
+            if disks is not None:
+                for disk in device_util.disk_details(server.get("config.hardware.device"),
+                                                     server.get("layoutEx.disk"),
+                                                     server.get("layoutEx.file")):
+                    disk['server'] = server.get("name")
+                    disk['server_uuid'] = server.get("config.instanceUuid")
+                    disks.append(disk)
             try:
-                server = self._server_detail(server)['server']
-                if not server.get('template', False):
-                    servers_list.append(server)
+                return self._server_detail(server, fields)['server']
             except KeyError:
                 LOG.error(_LE('Cannot get server detail'))
-        
-        return {"servers": servers_list}
+                return None
+
+        return _summary
     
     @staticmethod
     def _disk_number(disk_device):
-        disk_num = 0
-        for device in disk_device:
-            if device.__class__.__name__ == 'vim.vm.device.VirtualDisk':
-                disk_num = disk_num + 1
+        return device_util.disk_number(disk_device)
 
-        return disk_num
+    @staticmethod
+    def _disk_driver(disk_device):
+        """Returns the controller type of the first disk, such as pvscsi"""
+        disks = device_util.disk_details(disk_device)
+        if not disks:
+            return None
+        first_disk = min(disks, key=lambda disk: (disk['controllerBusNumber'] or 0,
+                                                   disk['unitNumber'] or 0))
+        return first_disk['controller']
     
     @staticmethod
-    def _list_servers_on_exsi(vc, user, pwd, uri):
+    def _list_servers_on_exsi(vc, user, pwd, uri, detail=None, refresh=False,
+                              properties=None):
         """ List servers and templates on specified ESXi
 
         :param vc: The IP address of vcenter
         :param user: The username of vcenter
         :param pwd: The password of vcenter
         :param uri: The uri of ESXi will be searched
+        :param detail: An optional callable applied to every server as it
+            is collected. Servers for which it returns None are dropped, so
+            the raw properties never have to be held for the whole host.
+        :param refresh: Set True to bypass the inventory cache and collect
+            the servers from vcenter, the cache is rebuilt as well.
+        :param properties: The property paths collected for every server,
+            default is all of the properties of ``SERVER_FIELDS``.
         :returns: dict to list
             when return is dict, the return is fault message
             of connect to vcenter or search uri.
             when return is list. the return is list of servers
             and templates.
         """
+        try:
+            return list(ViewBuilder._iter_servers_on_exsi(vc, user, pwd, uri, detail,
+                                                          refresh, properties))
+        except vSphereInventoryError as e:
+            return {"msg": e.message}
+
+    @staticmethod
+    def _iter_servers_on_exsi(vc, user, pwd, uri, detail=None, refresh=False,
+                              properties=None):
+        """ Iterate servers and templates on specified ESXi as collected
+
+        Same as ``_list_servers_on_exsi``, but the session is held until
+        the generator is exhausted or closed.
+
+        :raises: vSphereInventoryError if the vcenter could not be connected
+            or the uri could not be found
+        """
         # Ensure the uri does not start with '/'
         # and end with '/'
         if uri.startswith('/'):
@@ -103,45 +480,43 @@ class ViewBuilder(object):
             if vs.si is None:
                 LOG.error(_LE("Could not connect to the specified vcenter "
                               "using specified username and password."))
-                return {
-                    "msg": "Could not connect to the specified vcenter "
-                           "using specified username and password."
-                }
+                raise vSphereInventoryError("Could not connect to the specified vcenter "
+                                            "using specified username and password.")
             
-            datacenters = vs.si.content.rootFolder.childEntity
-            find_dc = False
-            for dc in datacenters:
-                if dc.name == uri[0]:
-                    find_dc = True
-                    break
-            
-            if not find_dc:
+            dc, host = vs.resolve_uri('/'.join(uri))
+            if dc is None:
                 LOG.error(_LE("Could not find specified datacenter %(datacenter_name)s.", 
-                              {'datacenter_name': dc.name}))
-                return {"msg": "Could not find specified datacenter %s." % dc.name}
-            
-            hosts = vs.get_container_view(dc, [vim.HostSystem])
-            find_host = False
-            for host in hosts:
-                if host.name == uri[-1]:
-                    find_host = True
-                    break
-            
-            if not find_host:
+                              {'datacenter_name': uri[0]}))
+                raise vSphereInventoryError("Could not find specified datacenter %s." % uri[0])
+
+            if host is None:
                 LOG.error(_LE("Could not find specified esxi %(host_name)s.",
-                              {'host_name': host.name}))
-                return {"msg": "Could not find specified esxi %s." % host.name}
-            
-            prop_spec = {
-                "VirtualMachine": ["name", 
-                                   "guest.toolsStatus", "guest.toolsRunningStatus", "guest.guestFullName", "guest.hostName", "guest.ipAddress",
-                                   "runtime.powerState", 
-                                   "config.template", "config.hardware.device", "config.hardware.numCPU", "config.hardware.memoryMB", 
-                                   "summary.storage.committed"]
-            }
+                              {'host_name': uri[-1]}))
+                raise vSphereInventoryError("Could not find specified esxi %s." % uri[-1])
+
+            servers = None
+            watcher = inventory.get_watcher(vc, user, pwd, SERVER_PROPERTIES)
+            # NOTE(jackdan): The inventory is indexed by ESXi host, clusters
+            # and properties it does not watch are collected from vcenter.
+            if (watcher is not None and isinstance(host, vim.HostSystem) and
+                    set(properties or SERVER_PROPERTIES).issubset(watcher.properties)):
+                if refresh:
+                    watcher.refresh()
+                else:
+                    servers = watcher.servers_on_host(host)
+                    LOG.debug("Inventory of %(vc)s at version %(version)s is %(state)s.",
+                              {'vc': vc, 'version': watcher.version,
+                               'state': 'used' if servers is not None else 'stale'})
 
-            servers = vs.property_collector(host, [vim.VirtualMachine], prop_spec)
-            return servers
+            if servers is None:
+                prop_spec = {"VirtualMachine": properties or SERVER_PROPERTIES}
+                servers = vs.property_collector_iter(host, [vim.VirtualMachine], prop_spec)
+            for server in servers:
+                if detail is not None:
+                    server = detail(server)
+                    if server is None:
+                        continue
+                yield server
 
     def _allow_server_numbers(self, req):
         """ List of server allowed for migration
@@ -150,11 +525,12 @@ class ViewBuilder(object):
         """
         result_number = dict()
 
-        hamal_license = db_api.license_get()
+        with db_api.reader():
+            hamal_license = db_api.license_get()
+            used_servers = len(db_api.task_history_get_by_all_succeed())
+
         license_message = self._parse_license_message(hamal_license.license)
-        
         server_numbers = license_message.get('server_nums')
-        used_servers = len(db_api.task_history_get_by_all_succeed())
 
         result_number['server_numbers'] = server_numbers
         result_number['used_servers'] = used_servers
@@ -163,6 +539,19 @@ class ViewBuilder(object):
                      {'server_numbers': server_numbers, 'used_servers': used_servers}))
         return {'server_numbers': result_number}
     
+    def _task_batch_create(self, req, body):
+        """Creates the migration tasks of a batch of servers
+
+        :param body: ``tasks`` holds the servers, the fields missing from
+            one of them are taken from the body
+        """
+        try:
+            parsed = tasks_view.parse_batch(body, TASK_FIELDS, TASK_REQUIRED_FIELDS)
+        except ValueError as e:
+            LOG.error(_LE("Invalid tasks request: %(e)s"), {'e': e})
+            return {"msg": six.text_type(e)}
+        return tasks_view.create_batch(parsed, db_api.task_create_bulk)
+
     @staticmethod
     def _parse_license_message(license):
         """ Parse the license information
@@ -29,6 +29,8 @@ from hamal.conf import cli
 from hamal.conf import token
 from hamal.conf import source_cluster
 from hamal.conf import destination_cluster
+from hamal.conf import vmware
+from hamal.conf import openstack
 
 
 CONF = cfg.CONF
@@ -48,6 +50,8 @@ cli.register_opts(CONF)
 token.register_opts(CONF)
 source_cluster.register_opts(CONF)
 destination_cluster.register_opts(CONF)
+vmware.register_opts(CONF)
+openstack.register_opts(CONF)
 
 
 # conf_modules = [
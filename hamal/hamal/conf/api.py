@@ -35,6 +35,12 @@ hamal_api_opts = [
         "use_rpc",
         default=False,
         help="Set True to enable RPC service."
+    ),
+    cfg.IntOpt(
+        "tasks_batch_max_size",
+        default=1000,
+        min=1,
+        help="The maximum number of tasks created by one batch request."
     )
 ]
 
@@ -61,6 +61,22 @@ Destination cluster floating network id
         default='',
         help='''
 Destination cluster glance host
+'''
+    ),
+    cfg.StrOpt(
+        'endpoint_interface',
+        default='public',
+        choices=['public', 'internal', 'admin'],
+        help='''
+Destination cluster endpoint interface of the service catalog used to call the
+services, the public endpoint is used when a service has no such endpoint
+'''
+    ),
+    cfg.StrOpt(
+        'region_name',
+        default='',
+        help='''
+Destination cluster region of the endpoints, any region when empty
 '''
     )
 ]
@@ -25,6 +25,35 @@ engine_opts = [
         default=-1,
         help="The interval time to check hosts. "
              "Set -1 to skip periodical task by default."
+    ),
+    cfg.IntOpt(
+        "task_lease_time",
+        default=600,
+        min=1,
+        help="The seconds an engine worker holds the tasks it claimed. "
+             "A worker renews the lease while it converts its tasks, the "
+             "tasks of which lease expired are claimed again."
+    ),
+    cfg.BoolOpt(
+        "task_claim_skip_locked",
+        default=True,
+        help="Claim tasks with SELECT ... FOR UPDATE SKIP LOCKED on MySQL "
+             "and PostgreSQL. Set False for the servers without SKIP LOCKED, "
+             "such as MySQL before 8.0."
+    ),
+    cfg.FloatOpt(
+        "progress_flush_interval",
+        default=5.0,
+        min=0,
+        help="The seconds between the batched writes of the buffered task "
+             "progress. Set 0 to write every progress update right away."
+    ),
+    cfg.IntOpt(
+        "progress_flush_delta",
+        default=10,
+        min=1,
+        help="The buffered task progress is written right away once a task "
+             "moved this number of percents from its last written percent."
     )
 ]
 
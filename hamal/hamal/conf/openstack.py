@@ -0,0 +1,261 @@
+# Copyright 2020 Hamal, Inc.
+
+from oslo_config import cfg
+
+
+openstack_group = cfg.OptGroup(
+    'openstack',
+    title='OpenStack Group',
+    help='''
+Options under this group are used to configure the OpenStack clients.
+The clients are used to call Keystone, Nova, Cinder, Neutron and Glance of
+the source and destination clusters.
+'''
+)
+
+
+OPENSTACK_ALL_OPTS = [
+    cfg.IntOpt(
+        'http_pool_connections',
+        default=10,
+        min=1,
+        help='''
+The number of connection pools cached by the HTTP session of every OpenStack
+endpoint host.
+'''
+    ),
+    cfg.IntOpt(
+        'http_pool_maxsize',
+        default=20,
+        min=1,
+        help='''
+The maximum number of keep-alive connections kept per OpenStack endpoint.
+It should not be lower than the number of concurrent calls to one endpoint.
+'''
+    ),
+    cfg.BoolOpt(
+        'http_pool_block',
+        default=False,
+        help='''
+Set True to wait for a free connection when all of the connections of an
+endpoint are in use, instead of opening an extra connection which is not
+kept after use.
+'''
+    ),
+    cfg.IntOpt(
+        'http_max_retries',
+        default=0,
+        min=0,
+        help='''
+The number of retries of a failed connection to an OpenStack endpoint.
+Requests which reached the server are never retried.
+'''
+    ),
+    cfg.FloatOpt(
+        'http_connect_timeout',
+        default=10.0,
+        min=1,
+        help='''
+The timeout in seconds to establish a connection to an OpenStack endpoint.
+'''
+    ),
+    cfg.FloatOpt(
+        'http_read_timeout',
+        default=120.0,
+        min=1,
+        help='''
+The timeout in seconds to wait for the response of an OpenStack endpoint
+once the request has been sent.
+'''
+    ),
+    cfg.StrOpt(
+        'keystone_version',
+        default='auto',
+        choices=['auto', 'v3', 'v2.0'],
+        help='''
+The keystone API used to authenticate to the OpenStack clusters.
+auto - the v3 API, or the v2.0 API when keystone has no v3 API.
+v3 - a project scoped token and the catalog are returned by one request.
+v2.0 - an unscoped token is rescoped to the tenant by a second request.
+'''
+    ),
+    cfg.StrOpt(
+        'user_domain_name',
+        default='Default',
+        help='''
+The domain of the users authenticated by the keystone v3 API.
+'''
+    ),
+    cfg.IntOpt(
+        'instances_page_size',
+        default=500,
+        min=1,
+        help='''
+The number of instances requested per page when instances are listed from
+nova. It should not be higher than the max_limit of the nova API.
+'''
+    ),
+    cfg.IntOpt(
+        'instances_max_limit',
+        default=1000,
+        min=1,
+        help='''
+The maximum number of instances returned in a single page of a paginated
+instances request.
+'''
+    ),
+    cfg.IntOpt(
+        'http_log_body_max_length',
+        default=1024,
+        min=0,
+        help='''
+The maximum number of characters of a request or response body logged at
+debug level, 0 disables the logging of bodies. Passwords and tokens are
+always redacted.
+'''
+    ),
+    cfg.FloatOpt(
+        'http_log_body_sample_rate',
+        default=1.0,
+        min=0.0,
+        max=1.0,
+        help='''
+The fraction of the successful requests of which the bodies are logged at
+debug level. The bodies of failed requests are always logged.
+'''
+    ),
+    cfg.IntOpt(
+        'bulk_concurrency',
+        default=8,
+        min=1,
+        help='''
+The maximum number of concurrent requests when many resources of a cluster
+are fetched by id, such as the instances and volumes of a migration wave.
+'''
+    ),
+    cfg.IntOpt(
+        'discovery_concurrency',
+        default=16,
+        min=1,
+        help='''
+The maximum number of concurrent list requests when the resources of every
+tenant and region of a source cloud are discovered.
+'''
+    ),
+    cfg.IntOpt(
+        'discovery_per_endpoint_concurrency',
+        default=4,
+        min=1,
+        help='''
+The maximum number of concurrent list requests to the same endpoint when the
+resources of a source cloud are discovered.
+'''
+    ),
+    cfg.IntOpt(
+        'bulk_filter_size',
+        default=50,
+        min=1,
+        help='''
+The maximum number of ids in the id filter of a single list request, for the
+APIs which can list resources by id such as neutron.
+'''
+    ),
+    cfg.FloatOpt(
+        'poller_min_interval',
+        default=2.0,
+        min=0.1,
+        help='''
+The interval in seconds between two polls of the status of the resources in
+flight, such as instances being started or volumes being created.
+'''
+    ),
+    cfg.FloatOpt(
+        'poller_max_interval',
+        default=30.0,
+        min=0.1,
+        help='''
+The maximum interval in seconds between two polls of the status of the
+resources in flight.
+'''
+    ),
+    cfg.FloatOpt(
+        'poller_backoff',
+        default=1.5,
+        min=1.0,
+        help='''
+The poll interval of a resource type is multiplied by this factor after every
+poll in which none of its resources changed status.
+'''
+    ),
+    cfg.IntOpt(
+        'poller_clock_skew',
+        default=60,
+        min=0,
+        help='''
+The seconds subtracted from the changes-since time of the instance polls, to
+allow for the clock difference between hamal and nova.
+'''
+    ),
+    cfg.IntOpt(
+        'cache_flavor_ttl',
+        default=600,
+        min=0,
+        help='''
+The seconds the flavors of a cluster are cached, 0 disables the cache.
+'''
+    ),
+    cfg.IntOpt(
+        'cache_volume_type_ttl',
+        default=600,
+        min=0,
+        help='''
+The seconds the volume types of a cluster are cached, 0 disables the cache.
+'''
+    ),
+    cfg.IntOpt(
+        'cache_network_ttl',
+        default=300,
+        min=0,
+        help='''
+The seconds the networks of a cluster are cached, 0 disables the cache.
+Hamal does not invalidate cached networks, a network changed outside of hamal
+is seen once this TTL passed.
+'''
+    ),
+    cfg.IntOpt(
+        'cache_security_group_ttl',
+        default=60,
+        min=0,
+        help='''
+The seconds the security groups of a cluster are cached, 0 disables the
+cache.
+'''
+    ),
+    cfg.IntOpt(
+        'cache_max_entries',
+        default=1024,
+        min=1,
+        help='''
+The maximum number of entries of every cache of the OpenStack resources, the
+least recently used entries are evicted.
+'''
+    ),
+    cfg.IntOpt(
+        'token_refresh_margin',
+        default=300,
+        min=0,
+        help='''
+The scoped token of a cluster is refreshed this number of seconds before it
+expires. Requests keep using the current token while it is refreshed.
+'''
+    )
+]
+
+
+def register_opts(conf):
+    conf.register_group(openstack_group)
+    conf.register_opts(OPENSTACK_ALL_OPTS, group=openstack_group)
+
+
+def list_opts():
+    return {openstack_group: OPENSTACK_ALL_OPTS}
@@ -40,6 +40,22 @@ Source Cluster authenticate name
         default='passw0rd',
         help='''
 Source Cluster authenticate password
+'''
+    ),
+    cfg.StrOpt(
+        'endpoint_interface',
+        default='public',
+        choices=['public', 'internal', 'admin'],
+        help='''
+Source Cluster endpoint interface of the service catalog used to call the
+services, the public endpoint is used when a service has no such endpoint
+'''
+    ),
+    cfg.StrOpt(
+        'region_name',
+        default='',
+        help='''
+Source Cluster region of the endpoints, any region when empty
 '''
     )
 ]
@@ -0,0 +1,152 @@
+# Copyright 2020 Hamal, Inc.
+
+from oslo_config import cfg
+
+
+vmware_group = cfg.OptGroup(
+    'vmware',
+    title='VMware Group',
+    help='''
+Options under this group are used to configure VMware.
+VMware is used to handle vcenter and vsphere parameters.
+'''
+)
+
+
+VMWARE_ALL_OPTS = [
+    cfg.IntOpt(
+        'property_collector_max_objects',
+        default=100,
+        min=1,
+        help='''
+The maximum number of ObjectContent data objects that should be returned
+in a single page from RetrievePropertiesEx and ContinueRetrievePropertiesEx.
+'''
+    ),
+    cfg.StrOpt(
+        'property_collector_mode',
+        default='view',
+        choices=['view', 'objects'],
+        help='''
+How the property collector reaches the objects of a container.
+view - the ContainerView is the single root and its objects are reached by
+one hop through the view.
+objects - every object of the view is a root of the full traversal.
+'''
+    ),
+    cfg.BoolOpt(
+        'session_pool_enabled',
+        default=True,
+        help='''
+Set True to keep vcenter sessions after use and reuse them for the next
+request with the same vcenter and credential.
+'''
+    ),
+    cfg.IntOpt(
+        'session_pool_max_idle',
+        default=4,
+        min=0,
+        help='''
+The maximum number of idle sessions kept per vcenter and credential.
+'''
+    ),
+    cfg.IntOpt(
+        'session_idle_timeout',
+        default=900,
+        min=1,
+        help='''
+Idle sessions which have not been used for this number of seconds are
+logged out.
+'''
+    ),
+    cfg.IntOpt(
+        'session_keepalive_interval',
+        default=300,
+        min=1,
+        help='''
+The interval in seconds of the heartbeat which keeps idle sessions alive.
+It should be lower than the session timeout of vcenter.
+'''
+    ),
+    cfg.BoolOpt(
+        'inventory_cache_enabled',
+        default=False,
+        help='''
+Set True to keep an in-memory inventory of the virtual machines of every
+vcenter which has been queried, updated incrementally by WaitForUpdatesEx.
+Each vcenter holds one extra session while its watcher is running.
+'''
+    ),
+    cfg.IntOpt(
+        'inventory_wait_seconds',
+        default=30,
+        min=1,
+        help='''
+The maxWaitSeconds of every WaitForUpdatesEx call of the inventory watcher.
+'''
+    ),
+    cfg.IntOpt(
+        'inventory_cache_max_staleness',
+        default=120,
+        min=0,
+        help='''
+The inventory is only used when it has been confirmed up to date within this
+number of seconds, otherwise the virtual machines are collected from vcenter.
+'''
+    ),
+    cfg.IntOpt(
+        'inventory_cache_idle_timeout',
+        default=3600,
+        min=1,
+        help='''
+The inventory watcher of a vcenter is stopped when its inventory has not been
+read for this number of seconds.
+'''
+    ),
+    cfg.IntOpt(
+        'inventory_max_retries',
+        default=5,
+        min=1,
+        help='''
+The inventory watcher of a vcenter gives up after this number of consecutive
+failed connections, so stale credentials do not lock the vCenter SSO account.
+The next request of the vcenter starts a new watcher.
+'''
+    ),
+    cfg.IntOpt(
+        'fanout_concurrency',
+        default=16,
+        min=1,
+        help='''
+The maximum number of targets collected concurrently when servers of several
+ESXi are listed in one request.
+'''
+    ),
+    cfg.IntOpt(
+        'fanout_per_vcenter_concurrency',
+        default=4,
+        min=1,
+        help='''
+The maximum number of targets of the same vcenter collected concurrently
+when servers of several ESXi are listed in one request.
+'''
+    ),
+    cfg.IntOpt(
+        'servers_max_limit',
+        default=1000,
+        min=1,
+        help='''
+The maximum number of servers returned in a single page of a paginated
+servers request.
+'''
+    )
+]
+
+
+def register_opts(conf):
+    conf.register_group(vmware_group)
+    conf.register_opts(VMWARE_ALL_OPTS, group=vmware_group)
+
+
+def list_opts():
+    return {vmware_group: VMWARE_ALL_OPTS}
@@ -0,0 +1,146 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Write-behind buffer of the task progress
+
+The transfer loops report the percent of their task far more often than
+anybody reads it. Instead of one transaction per report, only the latest
+percent of every task is kept in memory and the buffered percents are
+written in one batch every progress_flush_interval seconds. A task which
+moved progress_flush_delta percents from its last written percent is
+written right away, with every other buffered percent.
+
+The DB API applies the buffered percents to the tasks it reads, including
+the percents of a batch being written, and writes the buffered percent of a
+task along with its state transitions.
+"""
+
+import contextlib
+import threading
+import time
+
+from oslo_log import log as logging
+
+from hamal.i18n import _LE
+import hamal.conf
+
+
+LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+
+class ProgressBuffer(object):
+    """Coalesces the percent updates of the tasks of one table
+
+    :param name: The name of the tasks, for the logs
+    :param write: Callable writing a dict of task id to percent in one batch
+    """
+
+    def __init__(self, name, write):
+        self.name = name
+        self._write = write
+        self._lock = threading.Lock()
+        # NOTE(jackdan): Flushes are serialized, so an older batch is never
+        # written after a newer one.
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        # The batch being written, read until its transaction committed
+        self._inflight = {}
+        self._written = {}
+        self._thread = None
+        self.updates = 0
+        self.flushes = 0
+
+    def update(self, uuid, percent):
+        """Buffers the percent of a task"""
+        if CONF.progress_flush_interval <= 0:
+            self._write({uuid: percent})
+            return
+
+        with self._lock:
+            self._pending[uuid] = percent
+            self.updates += 1
+            written = self._written.get(uuid)
+            urgent = (written is None or
+                      abs(percent - written) >= CONF.progress_flush_delta)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='progress-%s' % self.name)
+                self._thread.daemon = True
+                self._thread.start()
+        if urgent:
+            self.flush()
+
+    def get(self, uuid):
+        """Returns the buffered percent of a task, None if there is none"""
+        with self._lock:
+            return self._pending.get(uuid, self._inflight.get(uuid))
+
+    def overlay(self, tasks):
+        """Sets the buffered percents on tasks read from the database"""
+        with self._lock:
+            if not self._pending and not self._inflight:
+                return tasks
+            for task in tasks:
+                if task is None:
+                    continue
+                percent = self._pending.get(task.id, self._inflight.get(task.id))
+                if percent is not None:
+                    task.percent = percent
+        return tasks
+
+    @contextlib.contextmanager
+    def transition(self, uuid):
+        """Forgets a task whose state changes, yields its buffered percent
+
+        The caller writes the yielded percent along with the new state, or
+        deletes the task, inside the with block. No batch is written
+        meanwhile, so an older batch cannot overwrite the final percent.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._written.pop(uuid, None)
+                percent = self._pending.pop(uuid, None)
+            yield percent
+
+    def flush(self):
+        """Writes the buffered percents in one batch"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._inflight = pending
+            if not pending:
+                return
+
+            try:
+                self._write(pending)
+            except Exception:
+                LOG.exception(_LE("Could not write the progress of %(count)d "
+                                  "%(name)s."), {'count': len(pending), 'name': self.name})
+                with self._lock:
+                    for uuid, percent in pending.items():
+                        self._pending.setdefault(uuid, percent)
+                    self._inflight = {}
+                return
+
+            with self._lock:
+                self._inflight = {}
+                self._written.update(pending)
+                self.flushes += 1
+
+    def _run(self):
+        while True:
+            time.sleep(max(CONF.progress_flush_interval, 0.1))
+            self.flush()
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'updates': self.updates,
+                'flushes': self.flushes
+            }
@@ -0,0 +1,61 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Schema upgrades of the tables of hamal
+
+register_models creates the missing tables only, the columns and indexes
+added to the models of the existing tables are created here. Every upgrade
+checks the schema first, so it is safe to run on every start. The columns
+added to existing tables must be nullable.
+"""
+
+from oslo_log import log as logging
+from sqlalchemy import inspect
+from sqlalchemy import text
+
+from hamal.db.sqlachemy import models
+from hamal.i18n import _LI
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _existing_tables(engine):
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    return inspector, [table for table in models.BASE.metadata.sorted_tables
+                       if table.name in tables]
+
+
+def _add_missing_columns(engine):
+    inspector, tables = _existing_tables(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    for table in tables:
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            LOG.info(_LI("Adding column %(column)s to table %(table)s."),
+                     {'column': column.name, 'table': table.name})
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    quote(table.name), quote(column.name),
+                    column.type.compile(dialect=engine.dialect))))
+
+
+def _create_missing_indexes(engine):
+    inspector, tables = _existing_tables(engine)
+    for table in tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            LOG.info(_LI("Creating index %(index)s on table %(table)s."),
+                     {'index': index.name, 'table': table.name})
+            index.create(engine)
+
+
+def upgrade(engine):
+    """Upgrades the schema of the existing tables to the models"""
+    _add_missing_columns(engine)
+    _create_missing_indexes(engine)
@@ -98,7 +98,7 @@ class User(BASE):
     extra = Column(sql.JsonBlob)
     enabled = Column('enabled', Boolean)
     default_project_id = Column(String(64))
-    email = Column(String(255))
+    email = Column(String(255), index=True)
 
 
 class LocalUser(BASE):
@@ -107,7 +107,7 @@ class LocalUser(BASE):
     __tablename__ = 'local_user'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(String(64))
+    user_id = Column(String(64), index=True)
     domain_id = Column(String(64))
     name = Column(String(255))
 
@@ -118,7 +118,7 @@ class Password(BASE):
     __tablename__ = 'password'
 
     id = Column(Integer, primary_key=True)
-    local_user_id = Column(Integer)
+    local_user_id = Column(Integer, index=True)
     password = Column(String(128))
 
 
@@ -140,8 +140,10 @@ class Tasks(BASE, HamalDBBASE):
     osp_flavor = Column(String(128))
     osp_storage = Column(String(128))
     osp_hamal_type = Column(String(36))
-    state = Column(String(36))
+    state = Column(String(36), index=True)
     percent = Column(Integer)
+    worker_id = Column(String(255))  # the engine worker which claimed it
+    lease_expires_at = Column(DateTime)
 
 
 class OpenstackTasks(BASE, HamalDBBASE):
@@ -158,8 +160,10 @@ class OpenstackTasks(BASE, HamalDBBASE):
     osp_flavor = Column(String(128))
     osp_storage = Column(String(128))
     osp_hamal_type = Column(String(36))
-    state = Column(String(36))
+    state = Column(String(36), index=True)
     percent = Column(Integer)
+    worker_id = Column(String(255))  # the engine worker which claimed it
+    lease_expires_at = Column(DateTime)
 
 
 class TaskHistory(BASE, HamalDBBASE):
@@ -102,6 +102,8 @@ class HamalException(Exception):
                 self.kwargs['code'] = self.code
             except AttributeError:
                 pass
+        else:
+            self.code = self.kwargs['code']
 
         for k, v in self.kwargs.items():
             if isinstance(v, Exception):
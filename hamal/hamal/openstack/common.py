@@ -42,4 +42,4 @@ class Wait(object):
                 
                 raise exc
             
-            time.sleep(5)
+            time.sleep(interval)
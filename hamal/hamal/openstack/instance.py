@@ -2,11 +2,11 @@
 
 from oslo_log import log as logging
 
-from hamal.exception import HamalException
 from hamal.exception import TimeoutHttpException
 from hamal.openstack.base import DataBase
 from hamal.openstack.base import SourceBase
-from hamal.openstack.common import Wait
+from hamal.openstack.poller import DELETED
+from hamal.openstack.poller import get_poller
 
 from hamal.openstack.volume import Volume
 # from hamal.openstack.flavor import Flavor
@@ -52,6 +52,22 @@ class Instance(SourceBase):
         plugin.nova.get_instance(source_id)
         return instance
     
+    @staticmethod
+    def get_many(plugin, source_ids):
+        """Returns OrderedDict of id to Instance, or to the fetch exception
+
+        The instances are fetched with bounded concurrency and their data
+        is kept, so instance_obj does not fetch them again.
+        """
+        instances = plugin.nova.get_instances(source_ids)
+        for source_id, data in instances.items():
+            if isinstance(data, Exception):
+                continue
+            instance = Instance(plugin, source_id)
+            instance._instance_obj = InstanceData(plugin, data)
+            instances[source_id] = instance
+        return instances
+
     @property
     def instance_obj(self):
         if self._instance_obj is not None:
@@ -68,21 +84,19 @@ class Instance(SourceBase):
     def delete(self):
         self.plugin.nova.delete_instance(self.id)
 
+    def wait_status(self, target_states, max_time=180):
+        """Waits until the instance reaches one of target_states
+
+        :raises: TimeoutHttpException after max_time seconds
+        """
+        return get_poller(self.plugin).wait('instance', self.id, target_states,
+                                            timeout=max_time)
+
     def delete_with_system_volume(self):
-        volumes = self._instance_obj.volumes
+        volumes = self.instance_obj.volumes
 
         self.plugin.nova.delete_instance(self.id)
-
-        def is_delete():
-            try:
-                self.show()
-            except HamalException as he:
-                LOG.exception(_LE('Hamal Exception with the %(he)s'), {'he': he})
-                if he.code == 404:
-                    return True
-        
-        wait = Wait(is_delete)
-        wait.wait(interval=3, max_time=180)
+        self.wait_status((DELETED, ), max_time=180)
 
         volumes[0].delete()
     
@@ -118,8 +132,7 @@ class Instance(SourceBase):
         if until_done:
             for i in range(3):
                 try:
-                    wait = Wait(self.is_active)
-                    wait.wait(interval=5, max_time=180)
+                    self.wait_status(('ACTIVE', ), max_time=180)
                     return
                 except TimeoutHttpException as timeoutHttpException:
                     LOG.exception(_LE('Hamal time out http exception is %(timeoutHttpException)s', 
@@ -133,8 +146,8 @@ class Instance(SourceBase):
         if until_done:
             for i in range(3):
                 try:
-                    wait = Wait(self.is_shutdown)
-                    wait.wait(interval=5, max_time=180)
+                    self.wait_status(('SHUTOFF', ), max_time=180)
+                    return
                 except TimeoutHttpException as timeoutHttpException:
                     LOG.exception(_LE('Hamal time out http exception is %(timeoutHttpException)s', 
                                       {'timeoutHttpException': timeoutHttpException}))
@@ -0,0 +1,335 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Status poller of the OpenStack resources in flight
+
+Instead of every caller polling its own resource, the callers subscribe
+the resource and the target states to the poller of the cluster. The poller
+queries every resource type once per tick for all of its subscriptions and
+resolves the futures of the resources which reached a target state.
+
+Instances are polled by the changes-since filter of nova, so a tick costs
+a single list request however many instances are subscribed. Cinder has no
+such filter, the subscribed volumes are fetched with bounded concurrency.
+
+The interval of a resource type grows while none of its resources changes
+status, and is reset when one changes or is subscribed.
+"""
+
+import collections
+import datetime
+import threading
+import time
+
+from oslo_log import log as logging
+
+from hamal.exception import HamalException
+from hamal.exception import TimeoutHttpException
+from hamal.i18n import _LE, _LW
+import hamal.conf
+
+
+LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+# The status of a resource which could not be found anymore
+DELETED = 'DELETED'
+
+FAILED_STATES = {
+    'instance': ('ERROR',),
+    'volume': ('ERROR', 'ERROR_DELETING', 'ERROR_RESTORING', 'ERROR_EXTENDING')
+}
+
+
+class StatusFuture(object):
+    """The pending result of a subscription"""
+
+    def __init__(self, resource_type, resource_id, target_states, failed_states,
+                 deadline):
+        self.resource_type = resource_type
+        self.resource_id = resource_id
+        self.target_states = target_states
+        self.failed_states = failed_states
+        self.deadline = deadline
+        self.status = None
+        self.data = None
+        self.error = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._event.is_set()
+
+    def add_done_callback(self, callback):
+        """Calls callback with the future once it is resolved"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _resolve(self, status=None, data=None, error=None):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.status = status
+            self.data = data
+            self.error = error
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                LOG.exception(_LE("Status callback of %(type)s %(id)s failed."),
+                              {'type': self.resource_type, 'id': self.resource_id})
+
+    def result(self, timeout=None):
+        """Returns the data of the resource once it reached a target state
+
+        :raises: TimeoutHttpException if the state is not reached in time,
+            Exception if the resource reached a failed state
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutHttpException()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+class StatusPoller(object):
+    """Polls the status of the subscribed resources of an OpenstackPlugin"""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        # resource_type -> resource_id -> list of StatusFuture
+        self._subscriptions = collections.defaultdict(dict)
+        # resource_type -> resource_id -> the last polled status
+        self._states = collections.defaultdict(dict)
+        self._intervals = {}
+        self._next_poll = {}
+        self._since = {}
+        self.polls = collections.Counter()
+
+    def subscribe(self, resource_type, resource_id, target_states, timeout=None,
+                  callback=None):
+        """Subscribes a resource until it reaches one of target_states
+
+        :param resource_type: instance or volume
+        :param resource_id: The id of the resource
+        :param target_states: The states to wait for, case insensitive.
+            DELETED is reached when the resource could not be found.
+        :param timeout: The seconds after which the future is resolved with
+            a TimeoutHttpException, None to wait forever
+        :param callback: Optional callable called with the resolved future
+        :returns: StatusFuture
+        """
+        if resource_type not in FAILED_STATES:
+            raise ValueError("Unknown resource type %s." % resource_type)
+
+        target_states = tuple(state.upper() for state in target_states)
+        deadline = time.time() + timeout if timeout is not None else None
+        future = StatusFuture(resource_type, resource_id, target_states,
+                              FAILED_STATES[resource_type], deadline)
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        with self._lock:
+            subscriptions = self._subscriptions[resource_type]
+            known = self._states[resource_type].get(resource_id)
+            if resource_id in subscriptions and known in target_states:
+                known_reached = True
+            else:
+                known_reached = False
+                subscriptions.setdefault(resource_id, []).append(future)
+        if known_reached:
+            # NOTE(jackdan): The state of a resource polled for another
+            # subscription is already known, it may not change anymore.
+            future._resolve(status=known)
+            return future
+
+        with self._lock:
+            self._intervals[resource_type] = CONF.openstack.poller_min_interval
+            self._next_poll[resource_type] = time.time()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='status-poller-%s' % self.plugin.cluster_name)
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def wait(self, resource_type, resource_id, target_states, timeout=None):
+        """Subscribes a resource and waits for its target state
+
+        :raises: TimeoutHttpException if the state is not reached in time,
+            even if the resource could not be polled at all
+        """
+        return self.subscribe(resource_type, resource_id, target_states,
+                              timeout=timeout).result(timeout)
+
+    def _expire(self, resource_type, now):
+        """Resolves the futures of resource_type past their deadline"""
+        expired = []
+        with self._lock:
+            subscriptions = self._subscriptions[resource_type]
+            for resource_id in list(subscriptions):
+                pending = []
+                for future in subscriptions[resource_id]:
+                    if future.deadline is not None and now > future.deadline:
+                        expired.append(future)
+                    else:
+                        pending.append(future)
+                if pending:
+                    subscriptions[resource_id] = pending
+                else:
+                    del subscriptions[resource_id]
+                    self._states[resource_type].pop(resource_id, None)
+
+        for future in expired:
+            future._resolve(status=None, error=TimeoutHttpException())
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            with self._lock:
+                pending = [resource_type for resource_type, subscriptions
+                           in self._subscriptions.items() if subscriptions]
+                if not pending:
+                    self._thread = None
+                    return
+                due = [resource_type for resource_type in pending
+                       if self._next_poll[resource_type] <= now]
+
+            for resource_type in due:
+                try:
+                    self._poll(resource_type)
+                except Exception:
+                    LOG.exception(_LE("Status poll of %(type)s failed."),
+                                  {'type': resource_type})
+                    # NOTE(jackdan): The deadlines are checked by _poll once
+                    # the resources are fetched, a failing fetch must not
+                    # keep the waiters beyond their deadline.
+                    self._expire(resource_type, time.time())
+                    with self._lock:
+                        self._next_poll[resource_type] = (time.time() +
+                                                          self._intervals[resource_type])
+
+            with self._lock:
+                next_poll = min([self._next_poll[resource_type] for resource_type, subscriptions
+                                 in self._subscriptions.items() if subscriptions] or [now])
+            self._wakeup.wait(max(next_poll - time.time(), 0))
+
+    def _fetch_instances(self, resource_ids, since):
+        """Returns dict of id to server data, or to the fetch exception"""
+        found = {}
+        unknown = [resource_id for resource_id in resource_ids
+                   if resource_id not in self._states['instance']]
+        if unknown:
+            for resource_id, data in self.plugin.nova.get_instances(unknown).items():
+                found[resource_id] = (data if isinstance(data, Exception)
+                                      else data['server'])
+
+        if since is not None and len(unknown) < len(resource_ids):
+            # NOTE(jackdan): Deleted instances are listed by changes-since
+            # as well, with the DELETED status.
+            changes_since = datetime.datetime.utcfromtimestamp(since).isoformat() + 'Z'
+            wanted = set(resource_ids)
+            for server in self.plugin.nova.iter_instances(filters={'changes-since': changes_since}):
+                if server['id'] in wanted:
+                    found[server['id']] = server
+        return found
+
+    def _fetch_volumes(self, resource_ids, since):
+        found = {}
+        for resource_id, data in self.plugin.cinder.get_volumes(resource_ids).items():
+            found[resource_id] = data if isinstance(data, Exception) else data['volume']
+        return found
+
+    def _poll(self, resource_type):
+        start = time.time()
+        with self._lock:
+            resource_ids = list(self._subscriptions[resource_type])
+            since = self._since.get(resource_type)
+
+        fetch = getattr(self, '_fetch_%ss' % resource_type)
+        found = fetch(resource_ids, since)
+        self.polls[resource_type] += 1
+
+        changed = False
+        resolved = []
+        with self._lock:
+            self._since[resource_type] = start - CONF.openstack.poller_clock_skew
+            subscriptions = self._subscriptions[resource_type]
+            states = self._states[resource_type]
+            for resource_id in resource_ids:
+                data = found.get(resource_id)
+                if isinstance(data, HamalException) and data.code == 404:
+                    status, data = DELETED, None
+                elif isinstance(data, Exception):
+                    LOG.warning(_LW("Could not poll %(type)s %(id)s: %(e)s"),
+                                {'type': resource_type, 'id': resource_id, 'e': data})
+                    status = None
+                elif data is not None:
+                    status = (data.get('status') or '').upper()
+                else:
+                    status = states.get(resource_id)
+
+                if status is not None and status != states.get(resource_id):
+                    states[resource_id] = status
+                    changed = True
+
+                pending = []
+                for future in subscriptions.get(resource_id, []):
+                    if status in future.target_states:
+                        resolved.append((future, dict(status=status, data=data)))
+                    elif status in future.failed_states:
+                        resolved.append((future, dict(status=status, data=data, error=Exception(
+                            "%s %s is %s" % (resource_type, resource_id, status)))))
+                    elif future.deadline is not None and start > future.deadline:
+                        resolved.append((future, dict(status=status, data=data,
+                                                      error=TimeoutHttpException())))
+                    else:
+                        pending.append(future)
+                if pending:
+                    subscriptions[resource_id] = pending
+                else:
+                    subscriptions.pop(resource_id, None)
+                    states.pop(resource_id, None)
+
+            # Resources subscribed during the poll are polled right away
+            if changed or set(subscriptions) - set(resource_ids):
+                interval = CONF.openstack.poller_min_interval
+            else:
+                interval = min(self._intervals[resource_type] * CONF.openstack.poller_backoff,
+                               CONF.openstack.poller_max_interval)
+            self._intervals[resource_type] = interval
+            self._next_poll[resource_type] = time.time() + interval
+            if set(subscriptions) - set(resource_ids):
+                self._next_poll[resource_type] = time.time()
+            if not subscriptions:
+                self._since.pop(resource_type, None)
+
+        for future, result in resolved:
+            future._resolve(**result)
+
+
+_POLLER_LOCK = threading.Lock()
+
+
+def get_poller(plugin):
+    """Returns the StatusPoller of an OpenstackPlugin"""
+    poller = getattr(plugin, '_status_poller', None)
+    if poller is not None:
+        return poller
+
+    with _POLLER_LOCK:
+        poller = getattr(plugin, '_status_poller', None)
+        if poller is None:
+            poller = plugin._status_poller = StatusPoller(plugin)
+        return poller
@@ -5,6 +5,7 @@ from oslo_log import log as logging
 from hamal.openstack.base import DataBase
 from hamal.openstack.base import SourceBase
 from hamal.openstack.common import Wait
+from hamal.openstack.poller import get_poller
 from hamal.db import api as db_api
 from hamal.i18n import _, _LE
 import hamal.conf
@@ -61,6 +62,22 @@ class Volume(SourceBase):
         plugin.cinder.get_volume(source_id)
         return volume
     
+    @staticmethod
+    def get_many(plugin, source_ids):
+        """Returns OrderedDict of id to Volume, or to the fetch exception
+
+        The volumes are fetched with bounded concurrency and their data is
+        kept, so volume_obj does not fetch them again.
+        """
+        volumes = plugin.cinder.get_volumes(source_ids)
+        for source_id, data in volumes.items():
+            if isinstance(data, Exception):
+                continue
+            volume = Volume(plugin, source_id)
+            volume._volume_obj = VolumeData(data)
+            volumes[source_id] = volume
+        return volumes
+
     @staticmethod
     def create(plugin, volume_size, display_name, display_description, volume_type=None):
         resp_data = plugin.cinder.create_volume(volume_size, display_name, display_description, volume_type=volume_type)
@@ -97,6 +114,14 @@ class Volume(SourceBase):
     def show(self):
         return self.plugin.cinder.get_volume(self.id)
 
+    def wait_status(self, target_states, max_time=300):
+        """Waits until the volume reaches one of target_states
+
+        :raises: TimeoutHttpException after max_time seconds
+        """
+        return get_poller(self.plugin).wait('volume', self.id, target_states,
+                                            timeout=max_time)
+
     def delete(self):
         return self.plugin.cinder.delete_volume(self.id)
     
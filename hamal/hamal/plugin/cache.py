@@ -0,0 +1,164 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+Cache of the OpenStack resources which rarely change
+
+Flavors, volume types, networks and security groups are read again and
+again while a migration wave is prepared, but are seldom changed. Their
+responses are cached per endpoint and tenant for a time to live of their
+own, bounded by a least recently used eviction. The create and delete
+calls of the plugins invalidate the cached entries of their resource.
+
+Flavors belong to the whole cloud and are cached per endpoint only, so a
+flavor created through the plugin of one tenant is seen by every tenant.
+Hamal never writes networks, they are only refreshed once their TTL passed.
+"""
+
+import collections
+import copy
+import functools
+import threading
+import time
+
+from oslo_log import log as logging
+
+import hamal.conf
+
+
+LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
+
+
+class TTLCache(object):
+    """Size bounded LRU cache whose entries expire after a TTL
+
+    :param name: The name of the cached resource
+    :param ttl_option: The option of the openstack group holding the TTL
+    :param per_tenant: Whether the entries are scoped by tenant as well as
+                       by endpoint
+    """
+
+    def __init__(self, name, ttl_option, per_tenant=True):
+        self.name = name
+        self._ttl_option = ttl_option
+        self.per_tenant = per_tenant
+        self._lock = threading.Lock()
+        # key -> (expire_timestamp, value), least recently used first
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        # NOTE(jackdan): Bumped by every invalidation, a value loaded while
+        # the generation changed may be stale and is not stored.
+        self._generation = 0
+
+    @property
+    def ttl(self):
+        return getattr(CONF.openstack, self._ttl_option)
+
+    def get(self, key, load):
+        """Returns a copy of the cached value of key, loaded on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return copy.deepcopy(entry[1])
+            self._misses += 1
+            generation = self._generation
+
+        value = load()
+        if self.ttl <= 0:
+            return value
+
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (time.time() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > CONF.openstack.cache_max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def invalidate(self, scope):
+        """Drops the entries of which key starts with scope"""
+        with self._lock:
+            self._generation += 1
+            keys = [key for key in self._entries if key[:len(scope)] == scope]
+            for key in keys:
+                del self._entries[key]
+            self._invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': lookups and float(self._hits) / lookups,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations
+            }
+
+
+CACHES = {
+    'flavor': TTLCache('flavor', 'cache_flavor_ttl', per_tenant=False),
+    'volume_type': TTLCache('volume_type', 'cache_volume_type_ttl'),
+    'network': TTLCache('network', 'cache_network_ttl'),
+    'security_group': TTLCache('security_group', 'cache_security_group_ttl'),
+}
+
+
+def _scope(plugin, cache):
+    """Returns the scope of a service plugin in cache
+
+    The scope is the endpoint and tenant of the plugin, or only its endpoint
+    for the resources shared by the tenants.
+    """
+    if not cache.per_tenant:
+        return (plugin.host_url, )
+    return (plugin.host_url, plugin.openstack.tenant_id)
+
+
+def cached(resource):
+    """Caches the result of a plugin method in the cache of resource"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = CACHES[resource]
+            key = (_scope(self, cache) + (func.__name__, ) + args +
+                   tuple(sorted(kwargs.items())))
+            return cache.get(key, lambda: func(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def invalidates(*resources):
+    """Invalidates the caches of resources once a plugin method returns"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                for resource in resources:
+                    cache = CACHES[resource]
+                    cache.invalidate(_scope(self, cache))
+        return wrapper
+    return decorator
+
+
+def stats():
+    """Returns the metrics of every cache"""
+    return dict((name, cache.stats()) for name, cache in CACHES.items())
@@ -1,13 +1,22 @@
 # Copyright 2020 Hamal, Inc.
 
+import urllib.parse
+
 from hamal.exception import HamalException
-from hamal.utils.plugin import get_request, post_request, delete_request
+from hamal.plugin import cache
+from hamal.utils.plugin import get_request, post_request, delete_request, fetch_many
+from hamal.utils.plugin import next_marker
+import hamal.conf
+
+
+CONF = hamal.conf.CONF
 
 
 SNAPSHOTS_URL = '/snapshots'
 SNAPSHOT_URL = '/snapshots/{snapshot_id}'
 
 VOLUMES_URL = '/volumes'
+VOLUMES_DETAIL_URL = '/volumes/detail'
 VOLUME_URL = '/volumes/{volume_id}'
 VOLUME_ACTION_URL = '/volumes/{volume_id}/action'
 
@@ -23,18 +32,51 @@ class CinderPlugin(object):
         self._snapshots_url = self.host_url + SNAPSHOTS_URL
         self._snapshot_url = self.host_url + SNAPSHOT_URL
         self._volumes_url = self.host_url + VOLUMES_URL
+        self._volumes_detail_url = self.host_url + VOLUMES_DETAIL_URL
         self._volume_url = self.host_url + VOLUME_URL
         self._volume_action_url = self.host_url + VOLUME_ACTION_URL
         self._types_url = self.host_url + TYPES_URL
     
     @property
     def openstack_user_token(self):
-        return self.openstack.token
+        return self.openstack.openstack_user_token
     
     def get_volume(self, volume_id):
         volume_url = self._volume_url.format(volume_id=volume_id)
         return get_request(volume_url, self.openstack_user_token)
     
+    def iter_volumes(self, filters=None, page_size=None):
+        """Iterate the volumes page by page as they are listed by cinder
+
+        :param filters: dict of the query parameters, such as all_tenants
+        :param page_size: The number of volumes per request, default is
+            ``[openstack] instances_page_size``
+        """
+        page_size = page_size or CONF.openstack.instances_page_size
+        marker = None
+        while True:
+            params = [(key, value) for key, value in sorted((filters or {}).items())
+                      if value is not None]
+            params.append(('limit', page_size))
+            if marker is not None:
+                params.append(('marker', marker))
+            resp_data = get_request(self._volumes_detail_url + '?' + urllib.parse.urlencode(params),
+                                    self.openstack_user_token)
+            volumes = resp_data.get('volumes', [])
+            for volume in volumes:
+                yield volume
+            marker = next_marker(resp_data.get('volumes_links'))
+            if marker is None or not volumes:
+                break
+
+    def get_volumes(self, volume_ids):
+        """Returns OrderedDict of volume id to get_volume of the id
+
+        Cinder can not list volumes by id, they are fetched concurrently.
+        A volume which could not be fetched maps to the exception.
+        """
+        return fetch_many(self.get_volume, volume_ids)
+
     def create_volume(self, size, display_name=None, display_description=None, image_id=None, volume_type=None):
         data = {
             "volume": {
@@ -118,5 +160,6 @@ class CinderPlugin(object):
         volume_url = self._volume_action_url(volume_id=volume_id)
         return post_request(volume_url, data, self.openstack_user_token, no_resp_content=True)
     
+    @cache.cached('volume_type')
     def get_volume_types(self):
         return get_request(self._types_url, self.openstack_user_token)
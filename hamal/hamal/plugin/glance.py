@@ -15,4 +15,4 @@ class GlancePlugin(object):
     
     @property
     def openstack_user_token(self):
-        return self.openstack.token
+        return self.openstack.openstack_user_token
@@ -1,6 +1,16 @@
 # Copyright 2020 Hamal, Inc.
 
+import collections
+import urllib.parse
+
+from hamal.exception import HamalException
+from hamal.plugin import cache
 from hamal.utils.plugin import get_request, post_request, delete_request, update_request
+from hamal.utils.plugin import chunks, next_marker
+import hamal.conf
+
+
+CONF = hamal.conf.CONF
 
 
 NETWORKS_URL = '/v2.0/network.json'
@@ -38,12 +48,14 @@ class NeutronPlugin(object):
 
     @property
     def openstack_user_token(self):
-        return self.openstack.token
+        return self.openstack.openstack_user_token
     
+    @cache.cached('network')
     def get_network(self, network_id):
         network_url = self._network_url.format(network_id=network_id)
         return get_request(network_url, self.openstack_user_token)
     
+    @cache.cached('network')
     def get_networks(self):
         return get_request(self._networks_url, self.openstack_user_token)
     
@@ -66,6 +78,64 @@ class NeutronPlugin(object):
         port_url = self._port_url.format(port_id=port_id)
         return get_request(port_url, self.openstack_user_token)
 
+    def _get_by_ids(self, list_url, resource, ids):
+        """Returns OrderedDict of id to {resource: data} listed by id filter
+
+        The ids are listed by ``[openstack] bulk_filter_size`` per request.
+        An id which is not listed maps to a HamalException of code 404, the
+        ids of a failed request map to its exception.
+        """
+        ids = list(collections.OrderedDict.fromkeys(ids))
+        found = {}
+        for chunk in chunks(ids, CONF.openstack.bulk_filter_size):
+            url = list_url + '?' + urllib.parse.urlencode([('id', resource_id)
+                                                           for resource_id in chunk])
+            try:
+                resp_data = get_request(url, self.openstack_user_token)
+            except Exception as e:
+                found.update((resource_id, e) for resource_id in chunk)
+                continue
+            for data in resp_data.get(resource + 's', []):
+                found[data['id']] = {resource: data}
+
+        result = collections.OrderedDict()
+        for resource_id in ids:
+            result[resource_id] = found.get(resource_id) or HamalException(
+                message="%s %s could not be found." % (resource, resource_id), code=404)
+        return result
+
+    def iter_ports(self, filters=None, page_size=None):
+        """Iterate the ports page by page as they are listed by neutron
+
+        :param filters: dict of the query parameters, such as tenant_id
+        :param page_size: The number of ports per request, default is
+            ``[openstack] instances_page_size``
+        """
+        page_size = page_size or CONF.openstack.instances_page_size
+        marker = None
+        while True:
+            params = [(key, value) for key, value in sorted((filters or {}).items())
+                      if value is not None]
+            params.append(('limit', page_size))
+            if marker is not None:
+                params.append(('marker', marker))
+            resp_data = get_request(self._ports_url + '?' + urllib.parse.urlencode(params),
+                                    self.openstack_user_token)
+            ports = resp_data.get('ports', [])
+            for port in ports:
+                yield port
+            marker = next_marker(resp_data.get('ports_links'))
+            if marker is None or not ports:
+                break
+
+    def list_ports(self, filters=None):
+        """Returns the ports of the query parameters filters, such as tenant_id"""
+        return list(self.iter_ports(filters=filters))
+
+    def get_ports(self, port_ids):
+        """Returns OrderedDict of port id to get_port of the id"""
+        return self._get_by_ids(self._ports_url, 'port', port_ids)
+
     def update_port(self, port_id, security_groups):
         port_url = self._port_url.format(port_id=port_id)
         data = {
@@ -76,14 +146,21 @@ class NeutronPlugin(object):
 
         return update_request(port_url, data, self.openstack_user_token)
 
+    @cache.cached('security_group')
     def get_security_group(self, security_group_id):
         security_group_url = self._security_group_url.format(security_group_id=security_group_id)
         return get_request(security_group_url, self.openstack_user_token)
     
+    def get_security_groups(self, security_group_ids):
+        """Returns OrderedDict of security group id to get_security_group of the id"""
+        return self._get_by_ids(self._security_groups_url, 'security_group', security_group_ids)
+
+    @cache.invalidates('security_group')
     def delete_security_group(self, security_group_id):
         security_group_url = self._security_group_url.format(security_group_id=security_group_id)
         return delete_request(security_group_url, self.openstack_user_token)
 
+    @cache.invalidates('security_group')
     def create_security_group(self, name):
         if name == 'default':
             name = 'hamal-default'
@@ -95,10 +172,12 @@ class NeutronPlugin(object):
 
         return post_request(self._security_groups_url, data, self.openstack_user_token)
     
+    @cache.invalidates('security_group')
     def delete_security_group_rule(self, security_group_rule_id):
         security_group_rule_url = self._security_group_rule_url.format(security_group_rule_id=security_group_rule_id)
         return delete_request(security_group_rule_url, self.openstack_user_token)
     
+    @cache.invalidates('security_group')
     def create_security_group_rule(self, security_group_id, direction, ethertype, port_range_max,
                                    port_range_min, protocol, remote_group_id, remote_ip_prefix):
         data = {
@@ -1,13 +1,19 @@
 # Copyright 2020 Hamal, Inc.
 
+import urllib.parse
+
 from oslo_log import log as logging
 
 from hamal.exception import HamalException
-from hamal.utils.plugin import get_request, post_request, delete_request
+from hamal.plugin import cache
+from hamal.utils.plugin import get_request, post_request, delete_request, fetch_many
+from hamal.utils.plugin import next_marker
 from hamal.i18n import _, _LE
+import hamal.conf
 
 
 LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
 
 INSTANCES_URL = '/servers/detail'
 INSTANCE_URL = '/servers/{instance_id}'
@@ -22,6 +28,11 @@ VOLUME_BOOT_URL = '/os-volumes_boot'
 
 IMAGE_URL = '/images/{image_id}'
 
+# The query parameters of INSTANCES_URL passed through to nova, name is a
+# regular expression and changes-since an ISO 8601 timestamp.
+INSTANCE_FILTERS = ('status', 'host', 'name', 'changes-since', 'flavor',
+                    'image', 'ip', 'all_tenants')
+
 
 class InterfacePlugin(object):
     """A plugin of Interface"""
@@ -50,13 +61,68 @@ class NovaPlugin(object):
     def openstack_user_token(self):
         return self.openstack.openstack_user_token
     
-    def get_list_instance(self):
-        return get_request(self._instances_url, self.openstack_user_token)
+    def get_list_instance(self, filters=None):
+        return {"servers": list(self.iter_instances(filters=filters))}
+
+    def _get_instances_page(self, filters=None, limit=None, marker=None):
+        """Returns a page of instances and the marker of the next page"""
+        params = [(key, value) for key, value in sorted((filters or {}).items())
+                  if value is not None]
+        if limit is not None:
+            params.append(('limit', limit))
+        if marker is not None:
+            params.append(('marker', marker))
+
+        instances_url = self._instances_url
+        if params:
+            instances_url += '?' + urllib.parse.urlencode(params)
+        resp_data = get_request(instances_url, self.openstack_user_token)
+        return resp_data.get('servers', []), next_marker(resp_data.get('servers_links'))
+
+    def iter_instances(self, filters=None, limit=None, marker=None, page_size=None):
+        """Iterate the instances page by page as they are listed by nova
+
+        The next page is requested with the marker of the next link of
+        servers_links, only when the previous page has been consumed.
+
+        :param filters: dict of the INSTANCE_FILTERS passed to nova
+        :param limit: The maximum number of instances, None for all of them
+        :param marker: The id of the instance after which to start
+        :param page_size: The number of instances per request, default is
+            ``[openstack] instances_page_size``
+        """
+        page_size = page_size or CONF.openstack.instances_page_size
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            instances, marker = self._get_instances_page(filters, size, marker)
+            for instance in instances:
+                yield instance
+            if remaining is not None:
+                remaining -= len(instances)
+            if marker is None or not instances:
+                break
+
+    def list_instances(self, filters=None, limit=None, marker=None):
+        """Returns at most limit instances and the marker of the next page"""
+        instances = list(self.iter_instances(filters=filters, limit=limit, marker=marker))
+        next_marker = None
+        if limit is not None and instances and len(instances) >= limit:
+            next_marker = instances[-1]['id']
+        return instances, next_marker
     
     def get_instance(self, instance_id):
         instance_url = self._instance_url.format(instance_id=instance_id)
         return get_request(instance_url, self.openstack_user_token)
 
+    def get_instances(self, instance_ids):
+        """Returns OrderedDict of instance id to get_instance of the id
+
+        Nova can not list instances by id, they are fetched concurrently.
+        An instance which could not be fetched maps to the exception.
+        """
+        return fetch_many(self.get_instance, instance_ids)
+
     def delete_instance(self, instance_id):
         instance_url = self._instance_url.format(instance_id=instance_id)
         return delete_request(instance_url, self.openstack_user_token)
@@ -128,13 +194,16 @@ class NovaPlugin(object):
 
         return post_request(instance_volume_attachment_url, data, self.openstack_user_token)
 
+    @cache.cached('flavor')
     def get_flavor(self, flavor_id):
         flavor_url = self._flavor_url.format(flavor_id=flavor_id)
         return get_request(flavor_url, self.openstack_user_token)
 
+    @cache.cached('flavor')
     def list_flavor(self):
         return get_request(self._flavors_url, self.openstack_user_token)
 
+    @cache.invalidates('flavor')
     def create_flavor(self, vcpus, disk, name, is_public, rxtx_factor, ephemeral, ram, swap):
         data = {
             "flavor": {
@@ -153,6 +222,7 @@ class NovaPlugin(object):
         resp_data = post_request(self._flavors_url, data, self.openstack_user_token)
         return resp_data
     
+    @cache.invalidates('flavor')
     def delete_flavor(self, flavor_id):
         flavor_url = self._flavor_url.format(flavor_id=flavor_id)
         return delete_request(flavor_url, self.openstack_user_token)
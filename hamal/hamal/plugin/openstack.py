@@ -2,18 +2,20 @@
 
 import time
 import calendar
+import hashlib
+import hmac
+import threading
 import urllib.parse
-from datetime import datetime
 
 from oslo_log import log as logging
+from oslo_utils import timeutils
 
 from hamal.plugin import nova
 from hamal.plugin import cinder
 from hamal.plugin import neutron
 from hamal.plugin import glance
 from hamal.exception import HttpException, HamalException
-from hamal.utils.plugin import post_request, is_req_success
-from hamal.plugin.utils import transfer_datetime
+from hamal.utils.plugin import get_request, post_request, is_req_success
 from hamal.i18n import _, _LE, _LW, _LI
 import hamal.conf
 
@@ -21,7 +23,11 @@ import hamal.conf
 LOG = logging.getLogger(__name__)
 CONF = hamal.conf.CONF
 
+# (cluster_name, auth_url, username, tenant_id) -> OpenstackPlugin, shared by
+# every request of the process
 CLUSTER_PLUGIN = {}
+_CLUSTER_PLUGIN_LOCK = threading.Lock()
+_CLUSTER_PLUGIN_AUTH_LOCKS = {}
 
 
 CLUSTERS = {
@@ -29,13 +35,17 @@ CLUSTERS = {
         'ceph_conf_path': CONF.source_cluster.ceph_conf_path,
         'auth_url': CONF.source_cluster.auth_url,
         'default_auth_name': CONF.source_cluster.default_auth_name,
-        'default_auth_password': CONF.source_cluster.default_auth_password
+        'default_auth_password': CONF.source_cluster.default_auth_password,
+        'endpoint_interface': CONF.source_cluster.endpoint_interface,
+        'region_name': CONF.source_cluster.region_name or None
     },
     'destination': {
         'ceph_conf_path': CONF.destination_cluster.ceph_conf_path,
         'auth_url': CONF.destination_cluster.auth_url,
         'default_auth_name': CONF.destination_cluster.default_auth_name,
         'default_auth_password': CONF.destination_cluster.default_auth_password,
+        'endpoint_interface': CONF.destination_cluster.endpoint_interface,
+        'region_name': CONF.destination_cluster.region_name or None,
         'network_id': CONF.destination_cluster.network_id,
         'floating_network_id': CONF.destination_cluster.floating_network_id,
         'glance_host': CONF.destination_cluster.glance_host or None
@@ -54,9 +64,19 @@ class OpenstackPlugin(object):
         self.password = password
         self.tenant_id = tenant_id
 
+        self._auth_lock = threading.Lock()
+        self._keystone_version = CONF.openstack.keystone_version
         self._openstack_user_token = None
         self._openstack_user_token_expire = None
         self.service_catalog = None
+        # (service type, interface, region) -> url, region None is the
+        # first endpoint of any region
+        self._endpoints = {}
+        # service name -> service type
+        self._service_types = {}
+        # region -> (nova, cinder, neutron) of the regions not in CLUSTERS
+        self._region_services = {}
+        self._services_lock = threading.Lock()
 
         self.nova = None
         self.cinder = None
@@ -68,13 +88,113 @@ class OpenstackPlugin(object):
 
         self.ceph_conf_path = str(CLUSTERS.get(cluster_name)['ceph_conf_path'])
 
+    @staticmethod
+    def _digest(password):
+        return hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+
+    def match_password(self, password):
+        """Returns True if password is the password of the plugin"""
+        return hmac.compare_digest(self._digest(self.password), self._digest(password))
+
     @property
     def openstack_user_token(self):
-        if time.time() > self._openstack_user_token_expire:
-            self.auth()
+        """Returns the scoped token, refreshed before it expires
+
+        Within ``[openstack] token_refresh_margin`` seconds of the expiry a
+        single caller refreshes the token while the others keep using the
+        current one. Once the token has expired every caller waits for the
+        same refresh.
+        """
+        now = time.time()
+        if now < self._openstack_user_token_expire - CONF.openstack.token_refresh_margin:
+            return self._openstack_user_token
+
+        if now < self._openstack_user_token_expire:
+            if self._auth_lock.acquire(False):
+                try:
+                    if time.time() >= (self._openstack_user_token_expire -
+                                       CONF.openstack.token_refresh_margin):
+                        self.auth()
+                except HttpException:
+                    LOG.warning(_LW("Hamal openstack token refresh failed, the "
+                                    "current token of cluster [%(cluster_name)s] "
+                                    "is used until it expires."),
+                                {"cluster_name": self.cluster_name})
+                finally:
+                    self._auth_lock.release()
+            return self._openstack_user_token
+
+        with self._auth_lock:
+            if time.time() >= self._openstack_user_token_expire:
+                self.auth()
         return self._openstack_user_token
+
     
+    @staticmethod
+    def _parse_expires(expires):
+        """Returns the UTC timestamp of an ISO 8601 token expiry"""
+        return calendar.timegm(timeutils.parse_isotime(expires).utctimetuple())
+
+    def _set_token(self, token, expires, service_catalog):
+        self._openstack_user_token = token
+        self._openstack_user_token_expire = self._parse_expires(expires)
+        LOG.info(_LI("Hamal openstack user token expire timestamp is %(timestamp)s"),
+                 {"timestamp": self._openstack_user_token_expire})
+        self.service_catalog = service_catalog
+        self._endpoints, self._service_types = self._parse_catalog(service_catalog)
+
     def auth(self):
+        """Gets a token scoped to the tenant and the service catalog
+
+        Keystone v3 returns both in a single request. With the 'auto'
+        keystone_version the v2.0 API is used when keystone has no v3 API,
+        and is kept for the later refreshes of the plugin.
+        """
+        if self._keystone_version == 'v2.0':
+            return self._auth_v2()
+
+        try:
+            return self._auth_v3()
+        except Exception as e:
+            if (self._keystone_version != 'auto' or not isinstance(e, HamalException) or
+                    e.code not in (300, 404)):
+                LOG.exception(_LW("Hamal openstack authentication v3 exception ERROR_CLUSTER : [%(cluster_name)s], ERROR_CONTENT : %(message)s"),
+                              {"cluster_name": self.cluster_name, "message": e})
+                raise HttpException(code=401, message="Cluster [%s] auth error : %s" % (self.cluster_name, str(e)))
+
+        LOG.info(_LI("Hamal openstack cluster [%(cluster_name)s] has no keystone v3 API, "
+                     "fall back to v2.0."), {"cluster_name": self.cluster_name})
+        self._keystone_version = 'v2.0'
+        return self._auth_v2()
+
+    def _auth_v3(self):
+        auth_url = self.auth_url + '/v3/auth/tokens'
+        data = {
+            "auth": {
+                "identity": {
+                    "methods": ["password"],
+                    "password": {
+                        "user": {
+                            "name": self.username,
+                            "domain": {"name": CONF.openstack.user_domain_name},
+                            "password": self.password
+                        }
+                    }
+                },
+                "scope": {
+                    "project": {
+                        "id": self.tenant_id
+                    }
+                }
+            }
+        }
+
+        headers, resp_data = post_request(url=auth_url, body=data, resp_headers=True)
+        self._set_token(headers['X-Subject-Token'], resp_data['token']['expires_at'], resp_data)
+        if self._keystone_version == 'auto':
+            self._keystone_version = 'v3'
+
+    def _auth_v2(self):
         auth_url = self.auth_url + '/v2.0/tokens'
         data = {
             "auth": {
@@ -108,24 +228,96 @@ class OpenstackPlugin(object):
             LOG.exception(_LW("Hamal openstack authentication TenantId exception ERROR_CLUSTER : [%(cluster_name)s], ERROR_CONTENT : %(message)s"), 
                           {"cluster_name": self.cluster_name, "message": str(e)})
             raise HttpException(code=401, message="Cluster [%s] auth error : %s" % (self.cluster_name, str(e)))
-        
-        self._openstack_user_token = resp_data['access']['token']['id']
 
-        token_expire_timestamp = calendar.timegm(datetime.strptime(transfer_datetime(resp_data['access']['token']['expires']),  "%Y-%m-%d %H:%M:%S").timetuple())
-        LOG.info(_LI("Hamal openstack user token expire timestamp is %(timestamp)s"), {"timestamp": token_expire_timestamp})
-        
-        self._openstack_user_token_expire = token_expire_timestamp - 300
-        self.service_catalog = resp_data
+        self._set_token(resp_data['access']['token']['id'],
+                        resp_data['access']['token']['expires'], resp_data)
     
-    def get_service_url(self, service_name):
-        for service in self.service_catalog['access']['serviceCatalog']:
-            if service_name == service['name']:
-                return service['endpoints'][0]['publicURL']
-        
-        LOG.exception(_LE("Hamal endpoint exception service name : %(service_name)s"), 
-                          {"service_name": service_name})
+    @staticmethod
+    def _parse_catalog(service_catalog):
+        """Returns the endpoints and the service types of a catalog
+
+        Both the v3 catalog and the v2.0 serviceCatalog are parsed into a
+        dict which maps (service type, interface, region) to the url, and
+        a dict which maps the service name to its type.
+        """
+        endpoints = {}
+        service_types = {}
+
+        def _add(service_type, interface, region, url):
+            endpoints.setdefault((service_type, interface, region), url)
+            endpoints.setdefault((service_type, interface, None), url)
+
+        if 'token' in service_catalog:
+            for service in service_catalog['token'].get('catalog', []):
+                service_types[service.get('name')] = service['type']
+                for endpoint in service['endpoints']:
+                    _add(service['type'], endpoint['interface'],
+                         endpoint.get('region_id') or endpoint.get('region'), endpoint['url'])
+        else:
+            for service in service_catalog['access']['serviceCatalog']:
+                service_types[service.get('name')] = service['type']
+                for endpoint in service['endpoints']:
+                    for interface in ('public', 'internal', 'admin'):
+                        url = endpoint.get(interface + 'URL')
+                        if url:
+                            _add(service['type'], interface, endpoint.get('region'), url)
+
+        return endpoints, service_types
+
+    def get_service_url(self, service_name, interface=None, region=None):
+        """Returns the endpoint url of a service of the cluster
+
+        :param service_name: The name or the type of the service
+        :param interface: public, internal or admin, default is the
+            endpoint_interface of the cluster. The public endpoint is used
+            when the service has no endpoint of the interface.
+        :param region: The region of the endpoint, default is the
+            region_name of the cluster, or any region.
+        """
+        cluster = CLUSTERS.get(self.cluster_name, {})
+        service_type = self._service_types.get(service_name, service_name)
+        region = region or cluster.get('region_name')
+        interfaces = [interface or cluster.get('endpoint_interface') or 'public', 'public']
+
+        for endpoint_interface in interfaces:
+            url = self._endpoints.get((service_type, endpoint_interface, region))
+            if url is not None:
+                return url
+
+        LOG.error(_LE("Hamal endpoint exception service name : %(service_name)s"),
+                  {"service_name": service_name})
         raise HttpException(code=400, message="%s endpoint not found" % service_name)
 
+    def regions(self, service_name):
+        """Returns the regions which have an endpoint of a service"""
+        service_type = self._service_types.get(service_name, service_name)
+        return sorted(set(region for endpoint_type, _interface, region in self._endpoints
+                          if endpoint_type == service_type and region is not None))
+
+    def region_services(self, region):
+        """Returns the Nova, Cinder and Neutron plugins of a region"""
+        if region is None or region == CLUSTERS.get(self.cluster_name, {}).get('region_name'):
+            return self.nova, self.cinder, self.neutron
+
+        with self._services_lock:
+            services = self._region_services.get(region)
+            if services is None:
+                services = self._region_services[region] = (
+                    nova.NovaPlugin(self.get_service_url('nova', region=region), self),
+                    cinder.CinderPlugin(self.get_service_url('cinder', region=region), self),
+                    neutron.NeutronPlugin(self.get_service_url('neutron', region=region), self))
+        return services
+
+    def list_projects(self):
+        """Returns the ids of the projects, the user should be admin"""
+        if self._keystone_version == 'v3':
+            resp_data = get_request(self.auth_url + '/v3/projects', self.openstack_user_token)
+            return [project['id'] for project in resp_data.get('projects', [])]
+
+        identity_url = self.get_service_url('identity', interface='admin')
+        resp_data = get_request(identity_url + '/tenants', self.openstack_user_token)
+        return [tenant['id'] for tenant in resp_data.get('tenants', [])]
+
     def init_services(self):
         nova_url = self.get_service_url('nova')
         cinder_url = self.get_service_url('cinder')
@@ -140,3 +332,36 @@ class OpenstackPlugin(object):
         self.cinder = cinder.CinderPlugin(cinder_url, self)
         self.neutron = neutron.NeutronPlugin(neutron_url, self)
         self.glance = glance.GlancePlugin(glance_url, self)
+
+
+def get_plugin(auth_url, cluster_name, username, password, tenant_id):
+    """Returns the OpenstackPlugin of a credential, shared by the process
+
+    The plugin holds the scoped token, the service catalog and the Nova,
+    Cinder, Neutron and Glance plugins. It is only created by the first
+    caller of a credential, concurrent callers wait for its authentication
+    instead of authenticating themselves.
+    """
+    key = (cluster_name, auth_url, username, tenant_id)
+    plugin = CLUSTER_PLUGIN.get(key)
+    if plugin is not None and plugin.match_password(password):
+        return plugin
+
+    with _CLUSTER_PLUGIN_LOCK:
+        auth_lock = _CLUSTER_PLUGIN_AUTH_LOCKS.setdefault(key, threading.Lock())
+
+    with auth_lock:
+        plugin = CLUSTER_PLUGIN.get(key)
+        if plugin is not None and plugin.match_password(password):
+            return plugin
+
+        # NOTE(jackdan): A plugin of another password is replaced, the
+        # password must be verified by keystone again.
+        plugin = OpenstackPlugin(auth_url, cluster_name, username, password, tenant_id)
+        CLUSTER_PLUGIN[key] = plugin
+        return plugin
+
+
+def forget_plugin(auth_url, cluster_name, username, tenant_id):
+    """Drops the shared plugin of a credential, such as after a 401"""
+    CLUSTER_PLUGIN.pop((cluster_name, auth_url, username, tenant_id), None)
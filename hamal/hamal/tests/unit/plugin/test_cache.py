@@ -0,0 +1,53 @@
+# Copyright 2020 Hamal, Inc.
+
+import unittest
+from unittest import mock
+
+from hamal.plugin import cache
+from hamal.plugin import nova
+import hamal.conf
+
+
+CONF = hamal.conf.CONF
+
+HOST_URL = 'http://nova.example.com:8774/v2.1'
+
+
+def _plugin(tenant_id):
+    openstack = mock.Mock(tenant_id=tenant_id, openstack_user_token='token')
+    return nova.NovaPlugin(HOST_URL, openstack)
+
+
+class FlavorCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(FlavorCacheTestCase, self).setUp()
+        CONF([], project='hamal', default_config_files=[])
+        self.addCleanup(CONF.reset)
+        for resource_cache in cache.CACHES.values():
+            resource_cache.clear()
+        self.flavors = [{'id': 'small'}]
+        patcher = mock.patch.object(
+            nova, 'get_request',
+            side_effect=lambda url, token: {'flavors': list(self.flavors)})
+        self.get_request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tenants_share_flavor_list(self):
+        first, second = _plugin('tenant-a'), _plugin('tenant-b')
+
+        self.assertEqual({'flavors': [{'id': 'small'}]}, first.list_flavor())
+        self.assertEqual({'flavors': [{'id': 'small'}]}, second.list_flavor())
+        self.assertEqual(1, self.get_request.call_count)
+
+    def test_flavor_create_invalidates_every_tenant(self):
+        first, second = _plugin('tenant-a'), _plugin('tenant-b')
+        second.list_flavor()
+
+        self.flavors.append({'id': 'large'})
+        with mock.patch.object(nova, 'post_request'):
+            first.create_flavor(1, 10, 'large', True, 1.0, 0, 1024, 0)
+
+        self.assertEqual({'flavors': [{'id': 'small'}, {'id': 'large'}]},
+                         second.list_flavor())
+        self.assertEqual(2, self.get_request.call_count)
@@ -1,208 +1,337 @@
 # Copyright 2020 Hamal, Inc.
 
+import collections
+from concurrent import futures
 import uuid
 import json
+import random
+import re
 import threading
+import time
 import urllib
-from urllib.error import HTTPError
+import urllib.parse
 
+import eventlet
+from eventlet import patcher
 from oslo_log import log as logging
 
 from hamal.i18n import _, _LE, _LI, _LW
 from hamal.exception import HamalException
+import hamal.conf
 from webob import Request
 import requests
-from requests import HTTPError
+from requests import adapters
 
 
 LOG = logging.getLogger(__name__)
+CONF = hamal.conf.CONF
 
 
 request_state = threading.local()
 
 
+class HTTPSessionPool(object):
+    """Keep-alive HTTP sessions, one per OpenStack endpoint host
+
+    Every Nova, Cinder, Neutron and Keystone call of the same endpoint goes
+    through the same requests.Session, so its TCP and TLS connections are
+    reused instead of opened for every call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (scheme, netloc) -> requests.Session
+        self._sessions = {}
+        self._requests = {}
+        self._failures = {}
+
+    @staticmethod
+    def _endpoint(url):
+        parsed = urllib.parse.urlsplit(url)
+        return parsed.scheme, parsed.netloc
+
+    @staticmethod
+    def _create_session():
+        session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=CONF.openstack.http_pool_connections,
+                                       pool_maxsize=CONF.openstack.http_pool_maxsize,
+                                       max_retries=CONF.openstack.http_max_retries,
+                                       pool_block=CONF.openstack.http_pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session(self, url):
+        """Returns the session of the endpoint host of url"""
+        endpoint = self._endpoint(url)
+        with self._lock:
+            session = self._sessions.get(endpoint)
+            if session is None:
+                session = self._sessions[endpoint] = self._create_session()
+                self._requests[endpoint] = 0
+                self._failures[endpoint] = 0
+            self._requests[endpoint] += 1
+        return session
+
+    def request(self, method, url, **kwargs):
+        """Sends a request through the session of the endpoint host of url
+
+        The connect and read timeouts of the [openstack] group are applied
+        unless a timeout is given.
+        """
+        kwargs.setdefault('timeout', (CONF.openstack.http_connect_timeout,
+                                      CONF.openstack.http_read_timeout))
+        session = self.session(url)
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._failures[self._endpoint(url)] += 1
+            raise
+
+    def close(self):
+        """Closes every session and its connections"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._requests.clear()
+            self._failures.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        """Returns the metrics of the session of every endpoint
+
+        ``connections`` is the number of connections opened to the endpoint
+        and ``reused`` the number of requests sent on an already opened
+        connection.
+        """
+        with self._lock:
+            sessions = list(self._sessions.items())
+            requests_sent = dict(self._requests)
+            failures = dict(self._failures)
+
+        stats = {}
+        for (scheme, netloc), session in sessions:
+            connections = 0
+            pool_requests = 0
+            adapter = session.get_adapter('%s://' % scheme)
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+            stats['%s://%s' % (scheme, netloc)] = {
+                'requests': requests_sent.get((scheme, netloc), 0),
+                'failures': failures.get((scheme, netloc), 0),
+                'connections': connections,
+                'reused': max(pool_requests - connections, 0)
+            }
+        return stats
+
+
+HTTP_SESSIONS = HTTPSessionPool()
+
+
 def is_req_success(code):
     if code in (200, 201, 202, 204):
         return True
     return False
 
 
-def post_request(url, body, token=None, no_resp_content=False):
-    request_id = get_request_id()
+# NOTE(jackdan): The closing quote is optional, so a value cut by the
+# truncation of a body is redacted as well.
+_SENSITIVE_VALUE = re.compile(r'("[^"]*(?:password|token|secret|adminPass)[^"]*"\s*:\s*)"[^"]*"?',
+                              re.IGNORECASE)
+_TOKEN_ID_VALUE = re.compile(r'("token"\s*:\s*\{[^{}]*?"id"\s*:\s*)"[^"]*"?')
 
-    # if isinstance(body, dict):
-    #    body = json.dumps(body)
-    
-    headers = {"Content-type": "application/json"}
 
-    if token is not None:
-        headers['X-Auth-Token'] = token
+def redact(text):
+    """Masks the passwords, tokens and secrets of a JSON text"""
+    text = _SENSITIVE_VALUE.sub(r'\1"***"', text)
+    return _TOKEN_ID_VALUE.sub(r'\1"***"', text)
+
+
+class LogBody(object):
+    """A request or response body which is only formatted when logged
+
+    The body is truncated to ``[openstack] http_log_body_max_length``
+    characters and redacted.
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def __str__(self):
+        body = self.body
+        if body is None:
+            return ''
+
+        limit = CONF.openstack.http_log_body_max_length
+        if isinstance(body, bytes):
+            text = body[:limit].decode('utf-8', 'replace')
+        elif isinstance(body, str):
+            text = body[:limit]
+        else:
+            body = json.dumps(body)
+            text = body[:limit]
+
+        text = redact(text)
+        if len(body) > limit:
+            text += '... (%d bytes)' % len(body)
+        return text
+
 
-    post_info = "[%s] : curl -X POST '%s' -d '%s' %s" % (
-        request_id, url, body, ' '.join([' -H "%s:%s"' % (key, value) for key, value in headers.items()])
-    )
+def _log_bodies():
+    """Returns True if the bodies of this request should be logged"""
+    if CONF.openstack.http_log_body_max_length <= 0:
+        return False
+    if not LOG.isEnabledFor(logging.DEBUG):
+        return False
+    return random.random() < CONF.openstack.http_log_body_sample_rate
 
+
+def _send(method, url, headers, body=None):
+    """Sends a request and logs its status, size and latency
+
+    The bodies are only logged at debug level, see ``LogBody``.
+    """
+    request_id = get_request_id()
+    kwargs = {'headers': headers}
+    if body is not None:
+        kwargs['json'] = body
+
+    start = time.time()
     try:
-        LOG.info(_LI("Hamal post request information: %(post_info)s"), 
-                     {'post_info': post_info})
-        response = requests.post(url=url, json=body, headers=headers)
-        # req = urllib.request.Request(url, data=bytes(urllib.parse.urlencode(body), 'utf8'), headers=headers)
-        # response = urllib.request.urlopen(req)
-    except HTTPError as he:
-        error_msg = he.fp.read()
-
-        LOG.error(_LE("Hamal post request http error information '[%(request_id)s]' %(post_info)s EXCEPTION : %(error_msg)s"), 
-                      {"request_id": request_id, "post_info": post_info, "error_msg": error_msg})
-        raise HamalException(message=error_msg)
+        response = HTTP_SESSIONS.request(method, url, **kwargs)
     except Exception as e:
-        LOG.exception(_LE("Hamal post request http exception information '[%(request_id)s]' %(post_info)s EXCEPTION : '%(e)s"), 
-                          {"request_id": request_id, "post_info": post_info, "e": e})
-        raise e
-    
-    code = response.status_code
-    content = response.content.decode()
+        LOG.error(_LE("Hamal %(method)s request [%(request_id)s] %(url)s failed after "
+                      "%(elapsed).1f ms, EXCEPTION : %(e)s"),
+                  {"method": method, "request_id": request_id, "url": url,
+                   "elapsed": (time.time() - start) * 1000, "e": e})
+        raise
+    elapsed = (time.time() - start) * 1000
 
+    code = response.status_code
+    values = {"method": method, "request_id": request_id, "url": url, "code": code,
+              "elapsed": elapsed, "length": len(response.content)}
     if is_req_success(code):
-        LOG.info(_LI("Hamal post request http success information '[%(request_id)s]' : RESP CODE : '%(code)s', RESP DATA : '%(content)s'"), 
-                     {"request_id": request_id, "code": code, "content": content})
-        if no_resp_content:
-            return
-        return json.loads(content)
+        LOG.info(_LI("Hamal %(method)s request [%(request_id)s] %(url)s : RESP CODE : "
+                     "%(code)s, %(elapsed).1f ms, %(length)s bytes"), values)
+        if _log_bodies():
+            LOG.debug("Hamal %(method)s request [%(request_id)s] REQ DATA : %(req)s, "
+                      "RESP DATA : %(resp)s",
+                      {"method": method, "request_id": request_id,
+                       "req": LogBody(body), "resp": LogBody(response.content)})
+    else:
+        values['resp'] = LogBody(response.content)
+        LOG.error(_LE("Hamal %(method)s request [%(request_id)s] %(url)s : RESP CODE : "
+                      "%(code)s, %(elapsed).1f ms, RESP DATA : %(resp)s"), values)
+    return response
+
+
+def _raise_for_status(response):
+    if not is_req_success(response.status_code):
+        raise HamalException(message=response.content.decode('utf-8', 'replace'),
+                             code=response.status_code)
+
+
+def post_request(url, body, token=None, no_resp_content=False, resp_headers=False):
+    """Posts body as JSON to url
+
+    When resp_headers is True a tuple of the response headers and the
+    response data is returned, such as for the X-Subject-Token of keystone.
+    """
+    headers = {"Content-type": "application/json"}
+    if token is not None:
+        headers['X-Auth-Token'] = token
 
-    LOG.error(_LE("Hamal post request http success information '[%(request_id)s]' : RESP CODE : '%(code)s', RESP DATA '%(content)s'"), 
-                  {"request_id": request_id, "code": code, "content": content})
-    raise HamalException(message=content)
+    response = _send('POST', url, headers, body)
+    _raise_for_status(response)
+    if no_resp_content:
+        return
+    if resp_headers:
+        return response.headers, json.loads(response.content)
+    return json.loads(response.content)
 
 
 def update_request(url, body, token=None, no_resp_content=False):
-    request_id = get_request_id()
-
-    # if isinstance(body, dict):
-        # body = json.dumps(body)
-    
     headers = {"Content-type": "application/json"}
     if token is not None:
         headers['X-Auth-Token'] = token
-    
-    post_info = "[%s] : curl -X PUT '%s' -d '%s' %s" % (
-        request_id, url, body, ' '.join([' -H "%s: %s"' % (key, value) for key, value in headers.items()])
-    )
 
-    try:
-        LOG.info(_LI("Hamal update request information : %(post_info)s", 
-                     {"post_info": post_info}))
-        response = requests.put(url=url, json=body, headers=headers)
-        # req = urllib.request.Request(url, body, headers=headers)
-        # req.get_method = lambda: 'PUT'
-        # response = urllib.request.urlopen(req)
-    except HTTPError as he:
-        error_msg = he.fp.read()
-        LOG.error(_LE("Hamal update request error information '[%(request_id)s]' %(post_info)s ERROR : %(error_msg)s"), 
-                      {"request_id": request_id, "post_info": post_info, "error_msg": error_msg})
-        raise HamalException(message=error_msg)
-    except Exception as e:
-        LOG.exception(_LE("Hamal update request exception information: '[%(request_id)s]' %(post_info)s EXCEPTION : %(e)s"), 
-                          {"request_id": request_id, "post_info": post_info, "e": e})
-        raise e
-    
-    code = response.status_code
-    content = response.content
-
-    if is_req_success(code):
-        LOG.info(_LI("Hamal update request success information '[%(request_id)s]' : RESP_CODE : %(code)s, RESP DATA : %(content)s"), 
-                     {"request_id": request_id, "code": code, "content": content})
-        if no_resp_content:
-            return
-        return json.loads(content)
-    
-    LOG.error(_LE("Hamal update request error information '[%(request_id)s' : RESP_CODE : %(code)s, RESP_DATA : %(content)s"), 
-                  {"request_id": request_id, "code": code, "content": content})
-    raise HamalException(message=content)
+    response = _send('PUT', url, headers, body)
+    _raise_for_status(response)
+    if no_resp_content:
+        return
+    return json.loads(response.content)
 
 
 def get_request(url, token, body=None):
-    request_id = get_request_id()
+    headers = {"Accept": "application/json",
+               "X-Auth-Token": token}
+
+    response = _send('GET', url, headers)
+    _raise_for_status(response)
+    return json.loads(response.content)
 
+
+def delete_request(url, token, body=None):
     headers = {"Accept": "application/json",
                "X-Auth-Token": token}
-    
-    get_info = "[%s] : curl -X GET '%s' %s" % (
-        request_id, url, ' '.join([' -H "%s : %s"' % (key, value) for key, value in headers.items()])
-    )
 
-    try:
-        LOG.info(_LI("Hamal get request information : %(get_info)s"), 
-                     {"get_info": get_info})
-        response = requests.get(url=url, headers=headers)
-
-        # req = urllib.request.Request(url, headers=headers)
-        # response = urllib.request.urlopen(req)
-    except HTTPError as he:
-        error_msg = he.fp.read()
-        LOG.error(_LE("Hamal get request error information : [%(request_id)s] %(get_info)s ERROR : %(error_msg)s"), 
-                      {"request_id": request_id, "get_info": get_info, "error_msg": error_msg})
-        raise HamalException(message=error_msg)
-    except Exception as e:
-        LOG.error(_LE("Hamal get request exception information : [%(request_id)s] %(get_info)s EXCEPTION : %(e)s"), 
-                      {"request_id": request_id, "get_info": get_info, "e": e})
-        raise e
-    
-    code = response.status_code
-    content = response.content
+    response = _send('DELETE', url, headers)
+    _raise_for_status(response)
+    return True
 
-    if is_req_success(code):
-        LOG.info(_LI("Hamal get request success information [%(request_id)s] : RESP CODE : %(get_info)s, RESP DATA : %(content)s"), 
-                     {"request_id": request_id, "get_info": get_info, "content": content})
-        # change to dict eval(content)
-        return json.loads(content)
-    
-    LOG.error(_LE("Hamal get request error information [%(request_id)s] : RESP CODE : %(get_info)s, RESP DATA : %(content)s"), 
-                  {"request_id": request_id, "get_info": get_info, "content": content})
-    raise HamalException(message=content)
 
+def fetch_many(fetch, ids, concurrency=None):
+    """Calls fetch for every id concurrently
 
-def delete_request(url, token, body=None):
+    Green threads are used when the process is monkey patched by eventlet,
+    such as the API, and native threads otherwise.
+
+    :param fetch: Callable which takes an id and returns its resource
+    :param ids: The ids to fetch, duplicated ids are fetched once
+    :param concurrency: The maximum number of concurrent calls, default is
+        ``[openstack] bulk_concurrency``
+    :returns: OrderedDict of id to the result of fetch, or to the exception
+        it raised, in the order of ids
+    """
+    ids = list(collections.OrderedDict.fromkeys(ids))
+    concurrency = min(concurrency or CONF.openstack.bulk_concurrency, len(ids) or 1)
     request_id = get_request_id()
 
-    headers = {"Accept": "application/json",
-               "X-Auth-Token": token}
-    
-    get_info = "[%s] : curl -X DELETE '%s' %s" % (
-        request_id, url, ' '.join([' -H "%s : %s"' % (key, value) for key, value in headers.items()])
-    )
+    def _fetch(resource_id):
+        set_request_id(request_id)
+        try:
+            return fetch(resource_id)
+        except Exception as e:
+            return e
 
-    try:
-        LOG.info(_LI("Hamal delete request information : %(get_info)s"), 
-                     {"get_info": get_info})
-        response = requests.delete(url=url, headers=headers)
-        # req = urllib.request.Request(url, headers=headers)
-        # req.get_method = lambda: 'DELETE'
-        # response = urllib.request.urlopen(req)
-    except HTTPError as he:
-        error_msg = he.fp.read()
-
-        if he.code == 404 and error_msg == '{"itemNotFound": {"message": "The resource could not be found.", "code": 404}}':
-            return True
-        
-        LOG.error(_LE("Hamal delete request error information : [%(request_id)s] %(get_info)s ERROR : %(error_msg)s"), 
-                      {"request_id": request_id, "get_info": get_info, "error_msg": error_msg})
-        raise HamalException(message=error_msg)
-    except Exception as e:
-        LOG.error(_LE("Hamal delete request [%(request_id)s] %(get_info)s, EXCEPTION : %(e)s"), 
-                      {"request_id": request_id, "get_info": get_info, "e": e})
-        raise e
-    
-    code = response.status_code
-    content = response.content
+    if patcher.is_monkey_patched('socket'):
+        results = eventlet.GreenPool(concurrency).imap(_fetch, ids)
+        return collections.OrderedDict(zip(ids, results))
 
-    if is_req_success(code):
-        LOG.info(_LI("Hamal delete request success information : [%(request_id)s] : RESP CODE : %(code)s, RESP DATA : %(content)s"), 
-                     {"request_id": request_id, "code": code, "content": content})
-        return True
-    
-    LOG.error(_LE("Hamal delete request error information : [%(request_id)s] : RESP CODE : %(code)s, RESP DATA : %(content)s"), 
-                  {"request_id": request_id, "code": code, "content": content})
-    raise HamalException(message=content)
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return collections.OrderedDict(zip(ids, executor.map(_fetch, ids)))
+
+
+def next_marker(links):
+    """Returns the marker of the next link of the links of a list response"""
+    for link in links or []:
+        if link.get('rel') == 'next':
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(link['href']).query)
+            return query.get('marker', [None])[0]
+    return None
+
+
+def chunks(items, size):
+    """Splits items into lists of at most size items"""
+    items = list(items)
+    return [items[index:index + size] for index in range(0, len(items), size)]
 
 
 def set_request_id(request_id):
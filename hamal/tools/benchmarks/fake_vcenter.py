@@ -0,0 +1,316 @@
+# Copyright 2020 Hamal, Inc.
+
+"""
+In-process stand-in of a vcenter for the inventory benchmarks
+
+Only the parts used by hamal.api.v1.vmware.driver are implemented: the
+PropertyCollector (RetrievePropertiesEx, ContinueRetrievePropertiesEx and
+CancelRetrievePropertiesEx), the ViewManager (CreateContainerView) and the
+SearchIndex (FindByInventoryPath, FindByDnsName and FindByIp).
+
+The managed objects and devices are real pyVmomi objects without a stub, so
+the isinstance checks of the driver behave as against a real vcenter. The
+property values of a virtual machine are built when its page is retrieved,
+so the memory of the fake server does not hide the memory of the client.
+"""
+
+import itertools
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+
+class FakeDynamicProperty(object):
+    __slots__ = ('name', 'val')
+
+    def __init__(self, name, val):
+        self.name = name
+        self.val = val
+
+
+class FakeObjectContent(object):
+    __slots__ = ('obj', 'propSet')
+
+    def __init__(self, obj, propSet):
+        self.obj = obj
+        self.propSet = propSet
+
+
+class FakeRetrieveResult(object):
+    __slots__ = ('objects', 'token')
+
+    def __init__(self, objects, token=None):
+        self.objects = objects
+        self.token = token
+
+
+class FakeContainerView(vim.view.ContainerView):
+    """A ContainerView which holds its objects instead of a server"""
+
+    def __init__(self, view_manager, objects):
+        super(FakeContainerView, self).__init__('session[fake]view-%d' % view_manager.created)
+        # NOTE(jackdan): Managed objects are read-only once they have a stub,
+        # set the attributes the same way pyVmomi does.
+        object.__setattr__(self, '_view_manager', view_manager)
+        object.__setattr__(self, '_objects', objects)
+
+    @property
+    def view(self):
+        return self._objects
+
+    def Destroy(self):
+        self._view_manager.destroyed += 1
+
+
+class FakeInventory(object):
+    """The datacenters, clusters, hosts and virtual machines of a vcenter
+
+    The virtual machines are spread evenly over the hosts, and the hosts
+    evenly over the clusters of every datacenter.
+    """
+
+    def __init__(self, vms=1000, hosts=1, clusters=1, datacenters=1, disks=1):
+        self.disks = disks
+        self.root = vim.Folder('group-d1')
+        self.datacenters = []
+        self.clusters = []
+        self.hosts = []
+        self.vms = []
+        self.names = {}
+        self.paths = {}
+        self.children = {}
+        self.host_of_vm = {}
+
+        host_count = max(hosts, datacenters * clusters)
+        for dc_index in range(datacenters):
+            dc = vim.Datacenter('datacenter-%d' % dc_index)
+            self._add(dc, 'dc-%d' % dc_index, self.root)
+            self.paths['dc-%d' % dc_index] = dc
+            self.datacenters.append(dc)
+            for cluster_index in range(clusters):
+                cluster = vim.ClusterComputeResource('domain-c%d-%d' % (dc_index, cluster_index))
+                cluster_name = 'cluster-%d' % cluster_index
+                self._add(cluster, cluster_name, dc)
+                self.paths['dc-%d/host/%s' % (dc_index, cluster_name)] = cluster
+                self.clusters.append((dc, cluster))
+
+        for host_index in range(host_count):
+            dc, cluster = self.clusters[host_index % len(self.clusters)]
+            host = vim.HostSystem('host-%d' % host_index)
+            host_name = 'esxi-%d' % host_index
+            self._add(host, host_name, cluster)
+            self.paths['%s/host/%s/%s' % (self.names[dc._moId],
+                                          self.names[cluster._moId],
+                                          host_name)] = host
+            self.hosts.append(host)
+
+        for vm_index in range(vms):
+            host = self.hosts[vm_index % len(self.hosts)]
+            vm = vim.VirtualMachine('vm-%d' % vm_index)
+            self._add(vm, 'server-%06d' % vm_index, host)
+            self.host_of_vm[vm._moId] = host
+            self.vms.append(vm)
+
+    def _add(self, obj, name, parent):
+        self.names[obj._moId] = name
+        self.children.setdefault(parent._moId, []).append(obj)
+
+    def descendants(self, container, object_type=None):
+        object_type = tuple(object_type or ())
+        pending = [container]
+        result = []
+        while pending:
+            obj = pending.pop()
+            for child in self.children.get(obj._moId, ()):
+                if not object_type or isinstance(child, object_type):
+                    result.append(child)
+                pending.append(child)
+        return result
+
+    def _devices(self, vm_index):
+        controller = vim.vm.device.ParaVirtualSCSIController(key=1000, busNumber=0)
+        devices = [controller]
+        for disk_index in range(self.disks):
+            backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+                fileName='[datastore-%d] server-%06d/server-%06d_%d.vmdk' % (
+                    vm_index % 4, vm_index, vm_index, disk_index),
+                diskMode='persistent',
+                thinProvisioned=bool(disk_index % 2),
+                eagerlyScrub=False)
+            devices.append(vim.vm.device.VirtualDisk(
+                key=2000 + disk_index,
+                unitNumber=disk_index,
+                controllerKey=1000,
+                capacityInKB=40 * 1024 * 1024,
+                capacityInBytes=40 * 1024 ** 3,
+                backing=backing,
+                deviceInfo=vim.Description(label='Hard disk %d' % (disk_index + 1),
+                                           summary='41,943,040 KB')))
+        devices.append(vim.vm.device.VirtualVmxnet3(key=4000, controllerKey=100))
+        return devices
+
+    def _layout(self, vm_index):
+        files = []
+        disks = []
+        for disk_index in range(self.disks):
+            files.append(vim.vm.FileLayoutEx.FileInfo(
+                key=disk_index,
+                name='[datastore-%d] server-%06d/server-%06d_%d-flat.vmdk' % (
+                    vm_index % 4, vm_index, vm_index, disk_index),
+                type='diskExtent',
+                size=10 * 1024 ** 3))
+            disks.append(vim.vm.FileLayoutEx.DiskLayout(
+                key=2000 + disk_index,
+                chain=[vim.vm.FileLayoutEx.DiskUnit(fileKey=[disk_index])]))
+        return disks, files
+
+    def vm_property(self, vm, path):
+        vm_index = int(vm._moId.split('-')[1])
+        if path == 'name':
+            return self.names[vm._moId]
+        if path == 'config.template':
+            return False
+        if path == 'config.instanceUuid':
+            return '00000000-0000-0000-0000-%012d' % vm_index
+        if path == 'config.hardware.numCPU':
+            return 2
+        if path == 'config.hardware.memoryMB':
+            return 4096
+        if path == 'config.hardware.device':
+            return self._devices(vm_index)
+        if path == 'layoutEx.disk':
+            return self._layout(vm_index)[0]
+        if path == 'layoutEx.file':
+            return self._layout(vm_index)[1]
+        if path == 'summary.storage.committed':
+            return 10 * 1024 ** 3 * self.disks
+        if path == 'runtime.powerState':
+            return 'poweredOn'
+        if path == 'runtime.host':
+            return self.host_of_vm[vm._moId]
+        if path == 'guest.toolsStatus':
+            return 'toolsOk'
+        if path == 'guest.toolsRunningStatus':
+            return 'guestToolsRunning'
+        if path == 'guest.guestFullName':
+            return 'CentOS 7 (64-bit)'
+        if path == 'guest.hostName':
+            return self.names[vm._moId]
+        if path == 'guest.ipAddress':
+            return '10.%d.%d.%d' % (vm_index >> 16 & 255, vm_index >> 8 & 255, vm_index & 255)
+        raise vmodl.query.InvalidProperty(name=path)
+
+
+class FakePropertyCollector(object):
+
+    def __init__(self, inventory):
+        self._inventory = inventory
+        self._retrievals = {}
+        self._tokens = itertools.count(1)
+        self.calls = 0
+        self.object_specs = 0
+        self.cancelled = 0
+
+    def _objects(self, filter_spec):
+        objects = []
+        for obj_spec in filter_spec.objectSet:
+            self.object_specs += 1
+            if isinstance(obj_spec.obj, FakeContainerView):
+                # NOTE(jackdan): One hop through the 'view' property
+                objects.extend(obj_spec.obj.view)
+            elif not obj_spec.skip:
+                objects.append(obj_spec.obj)
+        return objects
+
+    def _contents(self, filter_spec):
+        paths = dict()
+        for prop_spec in filter_spec.propSet:
+            paths[prop_spec.type] = list(prop_spec.pathSet)
+
+        for obj in self._objects(filter_spec):
+            for obj_type, obj_paths in paths.items():
+                if isinstance(obj, obj_type):
+                    yield FakeObjectContent(obj, [
+                        FakeDynamicProperty(path, self._inventory.vm_property(obj, path))
+                        for path in obj_paths])
+                    break
+
+    def _page(self, contents, max_objects):
+        objects = list(itertools.islice(contents, max_objects))
+        if len(objects) < max_objects:
+            return FakeRetrieveResult(objects)
+
+        token = str(next(self._tokens))
+        self._retrievals[token] = (contents, max_objects)
+        return FakeRetrieveResult(objects, token)
+
+    def RetrievePropertiesEx(self, specSet, options):
+        self.calls += 1
+        contents = itertools.chain.from_iterable(self._contents(spec) for spec in specSet)
+        return self._page(contents, options.maxObjects or 100)
+
+    def ContinueRetrievePropertiesEx(self, token):
+        self.calls += 1
+        contents, max_objects = self._retrievals.pop(token)
+        return self._page(contents, max_objects)
+
+    def CancelRetrievePropertiesEx(self, token):
+        self.cancelled += 1
+        self._retrievals.pop(token, None)
+
+
+class FakeViewManager(object):
+
+    def __init__(self, inventory):
+        self._inventory = inventory
+        self.created = 0
+        self.destroyed = 0
+
+    def CreateContainerView(self, container, type, recursive):
+        self.created += 1
+        return FakeContainerView(self, self._inventory.descendants(container, type))
+
+
+class FakeSearchIndex(object):
+
+    def __init__(self, inventory):
+        self._inventory = inventory
+        self.calls = 0
+
+    def FindByInventoryPath(self, inventoryPath):
+        self.calls += 1
+        return self._inventory.paths.get(inventoryPath)
+
+    def FindByDnsName(self, datacenter=None, dnsName=None, vmSearch=False):
+        self.calls += 1
+        for host in self._inventory.hosts:
+            if self._inventory.names[host._moId] == dnsName:
+                return host
+        return None
+
+    def FindByIp(self, datacenter=None, ip=None, vmSearch=False):
+        self.calls += 1
+        return None
+
+
+class FakeSessionManager(object):
+    currentSession = 'fake-session'
+
+
+class FakeContent(object):
+
+    def __init__(self, inventory):
+        self.rootFolder = inventory.root
+        self.propertyCollector = FakePropertyCollector(inventory)
+        self.viewManager = FakeViewManager(inventory)
+        self.searchIndex = FakeSearchIndex(inventory)
+        self.sessionManager = FakeSessionManager()
+
+
+class FakeServiceInstance(object):
+
+    def __init__(self, inventory):
+        self.content = FakeContent(inventory)
+
+    def CurrentTime(self):
+        return None
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# Copyright 2020 Hamal, Inc.
+
+"""
+Benchmark of the VMware inventory listing against a fake vcenter
+
+Measures vSphere.property_collector and ViewBuilder._list_servers_on_exsi
+with the in-process vcenter of fake_vcenter, so it runs offline on any
+Linux box. Every scenario runs in a forked process of its own, so the peak
+RSS of one scenario does not leak into the next one.
+
+Reported for every scenario:
+
+* latency: median and minimum wall time of the runs, in milliseconds
+* rss: growth of the peak resident set size over the forked process
+* traced: peak of the memory allocated by python, traced by tracemalloc
+* blocks: memory blocks still allocated by python after the run
+* calls: PropertyCollector calls per run, one per page
+* specs: ObjectSpecs sent to the PropertyCollector per run
+
+The server side cost of vcenter, the SOAP (de)serialization and the network
+are not modelled, compare collector strategies by the client side numbers
+and the number of calls and specs.
+
+Usage::
+
+    python tools/benchmarks/vmware_inventory.py --vms 1000,10000,100000 \\
+        --disks 1,4 --page-sizes 100,1000 --modes view,objects
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(__file__),
+                                                os.pardir,
+                                                os.pardir,
+                                                os.pardir))
+if os.path.exists(os.path.join(possible_topdir,
+                               'hamal',
+                               '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from pyVmomi import vim
+
+from hamal.api.v1.vmware.driver import session_pool
+from hamal.api.v1.vmware.driver import vsphere
+from hamal.api.views.vmware import servers as servers_view
+import hamal.conf
+
+import fake_vcenter
+
+
+CONF = hamal.conf.CONF
+
+SCENARIOS = ('collector', 'collector-iter', 'servers', 'servers-disks')
+MODES = ('view', 'objects')
+VCENTER = ('fake-vcenter', 'administrator@vsphere.local', 'secret')
+
+
+def _sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+def _names(choices):
+    def _parse(value):
+        names = value.split(',')
+        for name in names:
+            if name not in choices:
+                raise argparse.ArgumentTypeError('%s is not one of %s'
+                                                 % (name, ', '.join(choices)))
+        return names
+    return _parse
+
+
+def _current_rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _collector(uri, consume):
+    """Returns a run which collects the servers properties of uri"""
+    prop_spec = {"VirtualMachine": servers_view.SERVER_PROPERTIES}
+
+    def _run():
+        with vsphere.vSphere(host=VCENTER[0], user=VCENTER[1], pwd=VCENTER[2]) as vs:
+            _dc, container = vs.resolve_uri(uri)
+            if consume:
+                count = sum(1 for _server in vs.property_collector_iter(
+                    container, [vim.VirtualMachine], prop_spec))
+            else:
+                count = len(vs.property_collector(container, [vim.VirtualMachine],
+                                                  prop_spec))
+        return count
+
+    return _run
+
+
+def _servers(uri, disks):
+    """Returns a run which lists the servers of uri as /servers does"""
+    view_builder = servers_view.ViewBuilder()
+
+    def _run():
+        disk_rows = [] if disks else None
+        servers = view_builder._list_servers_on_exsi(
+            VCENTER[0], VCENTER[1], VCENTER[2], uri,
+            detail=view_builder._server_summary(disks=disk_rows),
+            properties=servers_view.server_properties(disks=disks))
+        if isinstance(servers, dict):
+            raise RuntimeError(servers['msg'])
+        return len(servers)
+
+    return _run
+
+
+def _scenario_run(scenario, uri):
+    if scenario == 'collector':
+        return _collector(uri, consume=False)
+    if scenario == 'collector-iter':
+        return _collector(uri, consume=True)
+    return _servers(uri, disks=(scenario == 'servers-disks'))
+
+
+def _measure(inventory, scenario, mode, page_size, uri, repeat, conn):
+    """Runs a scenario in the forked process and sends its result to conn"""
+    CONF.set_override('property_collector_mode', mode, group='vmware')
+    CONF.set_override('property_collector_max_objects', page_size, group='vmware')
+
+    si = fake_vcenter.FakeServiceInstance(inventory)
+    vsphere.VMwareDriver._login = lambda self: si
+    run = _scenario_run(scenario, uri)
+
+    # NOTE(jackdan): The first run logs in and warms the session pool and
+    # the memoized inventory paths, as a long running API process would be.
+    count = run()
+    pc = si.content.propertyCollector
+    calls, specs = pc.calls, pc.object_specs
+
+    gc.collect()
+    rss_before = _current_rss()
+    latencies = []
+    for _index in range(repeat):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    run()
+    _current, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks_before
+
+    latencies.sort()
+    conn.send({
+        'scenario': scenario,
+        'mode': mode,
+        'page_size': page_size,
+        'servers': count,
+        'latency_ms': latencies[len(latencies) // 2] * 1000,
+        'latency_min_ms': latencies[0] * 1000,
+        'rss_mb': max(rss_peak - rss_before, 0) / 1024 ** 2,
+        'traced_mb': traced_peak / 1024 ** 2,
+        'blocks': blocks,
+        'calls': (pc.calls - calls) // (repeat + 1),
+        'specs': (pc.object_specs - specs) // (repeat + 1),
+        'views_leaked': si.content.viewManager.created - si.content.viewManager.destroyed,
+        'session_pool': session_pool.SESSION_POOL.stats(),
+    })
+    conn.close()
+
+
+def run_scenario(inventory, scenario, mode, page_size, uri, repeat):
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_measure,
+                              args=(inventory, scenario, mode, page_size,
+                                    uri, repeat, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError('Scenario %s (%s) exited with %s'
+                           % (scenario, mode, process.exitcode))
+    return result
+
+
+ROW = ('{vms:>7} {hosts:>5} {disks:>5} {scenario:<15} {mode:<8} {page_size:>6} '
+       '{latency_ms:>10.1f} {latency_min_ms:>10.1f} {rss_mb:>8.1f} '
+       '{traced_mb:>9.1f} {blocks:>9} {calls:>6} {specs:>7}')
+HEADER = ('{:>7} {:>5} {:>5} {:<15} {:<8} {:>6} {:>10} {:>10} {:>8} {:>9} '
+          '{:>9} {:>6} {:>7}').format('vms', 'hosts', 'disks', 'scenario',
+                                      'mode', 'page', 'median_ms', 'min_ms',
+                                      'rss_mb', 'traced_mb', 'blocks',
+                                      'calls', 'specs')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--vms', type=_sizes, default=[1000, 10000],
+                        help='Comma separated numbers of virtual machines')
+    parser.add_argument('--hosts', type=_sizes, default=[8],
+                        help='Comma separated numbers of ESXi hosts')
+    parser.add_argument('--disks', type=_sizes, default=[1],
+                        help='Comma separated numbers of disks per server')
+    parser.add_argument('--page-sizes', type=_sizes, default=[100, 1000],
+                        help='Comma separated page sizes of RetrievePropertiesEx')
+    parser.add_argument('--modes', type=_names(MODES), default=list(MODES),
+                        help='Comma separated collector modes: %s' % ', '.join(MODES))
+    parser.add_argument('--scenarios', type=_names(SCENARIOS), default=list(SCENARIOS),
+                        help='Comma separated scenarios: %s' % ', '.join(SCENARIOS))
+    parser.add_argument('--target', choices=('cluster', 'host'), default='cluster',
+                        help='Collect the servers of the whole cluster or of '
+                             'its first ESXi host')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timed runs per scenario')
+    parser.add_argument('--json', action='store_true',
+                        help='Print one JSON document per scenario')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    CONF([], project='hamal', default_config_files=[])
+    CONF.set_override('inventory_cache_enabled', False, group='vmware')
+
+    uri = 'dc-0/cluster-0' if args.target == 'cluster' else 'dc-0/cluster-0/esxi-0'
+    if not args.json:
+        print(HEADER)
+
+    for vms, hosts, disks in itertools.product(args.vms, args.hosts, args.disks):
+        inventory = fake_vcenter.FakeInventory(vms=vms, hosts=hosts, disks=disks)
+        for scenario, mode, page_size in itertools.product(args.scenarios, args.modes,
+                                                           args.page_sizes):
+            result = run_scenario(inventory, scenario, mode, page_size, uri,
+                                  args.repeat)
+            result.update(vms=vms, hosts=hosts, disks=disks)
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print(ROW.format(**result))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())